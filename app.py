@@ -10,24 +10,31 @@ Multi-tool SaaS platform for quick professional tasks:
 
 Pricing: Credit-based system (1 task = 1 credit)
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Request, Header
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
 from rembg import remove
 from PIL import Image
-import io
 import uuid
 from pathlib import Path
 import os
 from datetime import datetime
 import stripe
-from typing import Union, List
+from typing import Union, List, BinaryIO, Iterator, Optional
 import math
+import zipfile
+import json
+import logging
+import mimetypes
+from urllib.parse import quote
+from contextvars import ContextVar
 
 # Import our modules
-from database import get_db, init_db
+from database import get_db, init_db, SessionLocal
 from models import User, UsageRecord, APIKey
 from auth import (
     hash_password, verify_password, create_access_token,
@@ -41,7 +48,23 @@ from schemas import (
     UserCreate, UserLogin, Token, UserResponse,
     ProcessImageResponse, UsageStats, CheckoutSession, CheckoutSessionRequest
 )
-from watermark import add_watermark
+from uploads import (
+    ingest_upload, IngestedUpload, store_upload, get_stored_upload, open_stored_upload,
+    delete_stored_upload, purge_expired_uploads, UPLOAD_STORE_TTL,
+    create_resumable, get_resumable, append_resumable, complete_resumable,
+    finalize_resumable, delete_resumable, OffsetMismatchError, cache_large
+)
+from zipstream import iter_zip
+from artifacts import build_artifacts, render_preview
+from jobs import Job, JobError, JobTimeout, create_job, get_job, run_in_worker, start_background
+from codec import (
+    decode_image, encode_image, normalize_format, format_extension,
+    probe_image, sniff_format, ImageInfo, ImageTooLargeError, SNIFF_BYTES,
+    MAX_IMAGE_PIXELS, ENCODE_BUDGETS_MS, EFFORT_LADDERS, set_encode_budget
+)
+
+# Log output (encoder timings are logged at INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
 # Initialize app
 app = FastAPI(
@@ -59,6 +82,59 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized request bodies before they are parsed
+# (largest single upload is 100MB for pdf-to-images; batches can add up)
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", 200 * 1024 * 1024))
+
+
+@app.middleware("http")
+async def limit_request_size(request, call_next):
+    """Return 413 for requests whose declared body size is over the limit"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Request too large. Max {MAX_REQUEST_BYTES // (1024 * 1024)}MB"}
+        )
+    return await call_next(request)
+
+
+# Uploads resolved while handling the current request
+_request_uploads: ContextVar[Optional[list]] = ContextVar("request_uploads", default=None)
+
+
+class CloseUploadsMiddleware:
+    """
+    Close every upload a request resolved once its response has been sent.
+    
+    IngestedUpload holds a spooled temp file or an open store handle (and
+    maybe an mmap); this releases them even when a tool returns or fails
+    without closing its input. Streaming responses finish first, since
+    the inner app only returns after the last body chunk.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        uploads = []
+        token = _request_uploads.set(uploads)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_uploads.reset(token)
+            for upload in uploads:
+                upload.close()
+
+
+# Outermost, so it sees the end of the whole response
+app.add_middleware(CloseUploadsMiddleware)
+
+
 # Stripe configuration
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "sk_test_placeholder")
 
@@ -123,6 +199,199 @@ STATIC_DIR = Path("static")
 for directory in [UPLOAD_DIR, OUTPUT_DIR, STATIC_DIR]:
     directory.mkdir(exist_ok=True)
 
+# Image types accepted by the photo tools (detected from magic bytes)
+WEB_IMAGE_FORMATS = ["JPEG", "PNG", "WEBP"]
+
+
+def validate_image_upload(
+    source: Union[bytes, BinaryIO],
+    allowed_formats: List[str] = WEB_IMAGE_FORMATS,
+    error: str = "Invalid file type"
+) -> ImageInfo:
+    """
+    Identify an uploaded image from its header and enforce the pixel budget.
+    
+    Runs before any full decode and ignores the client-supplied content type,
+    so mislabelled files and decompression bombs are rejected up front.
+    """
+    try:
+        info = probe_image(source)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=error)
+    
+    if info.format not in allowed_formats:
+        raise HTTPException(status_code=400, detail=error)
+    
+    return info
+
+
+def require_pdf(upload: IngestedUpload, error: str = "File must be a PDF"):
+    """Reject uploads that don't start with the PDF signature"""
+    if sniff_format(upload.head(SNIFF_BYTES)) != "PDF":
+        raise HTTPException(status_code=400, detail=error)
+
+
+def track_upload(upload: IngestedUpload) -> IngestedUpload:
+    """Have the upload closed when the current request's response is sent"""
+    uploads = _request_uploads.get()
+    if uploads is not None:
+        uploads.append(upload)
+    return upload
+
+
+def release_upload(upload: IngestedUpload):
+    """Keep the upload open past the response (the caller closes it)"""
+    uploads = _request_uploads.get()
+    if uploads is not None and upload in uploads:
+        uploads.remove(upload)
+
+
+async def resolve_upload(
+    file: UploadFile,
+    upload_id: str,
+    user: User,
+    max_bytes: int,
+    error: str = "File too large"
+) -> IngestedUpload:
+    """
+    Get a tool's input from either a multipart file or a stored upload_id.
+    
+    Stored uploads are read from disk with no transfer and carry their
+    cache of decoded/derived data. Size limits apply the same way. The
+    upload is closed once the response has been sent.
+    """
+    if upload_id:
+        try:
+            upload = open_stored_upload(upload_id, user.id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+        
+        if upload.size > max_bytes:
+            upload.close()
+            raise HTTPException(status_code=400, detail=error)
+        return track_upload(upload)
+    
+    if file is None:
+        raise HTTPException(status_code=400, detail="Provide a file or an upload_id")
+    
+    return track_upload(await ingest_upload(file, max_bytes=max_bytes, error=error))
+
+
+async def resolve_uploads(
+    files: List[UploadFile],
+    upload_ids: str,
+    user: User,
+    max_bytes: int,
+    error: str = "File too large: {filename}"
+) -> List[IngestedUpload]:
+    """
+    Multi-file version of resolve_upload().
+    
+    upload_ids is a comma-separated list; stored uploads come first, then
+    any files. error may contain {filename}.
+    """
+    uploads = []
+    
+    for upload_id in (upload_ids or "").split(","):
+        if upload_id.strip():
+            uploads.append(await resolve_upload(None, upload_id.strip(), user, max_bytes, error.format(filename=upload_id.strip())))
+    
+    for file in files or []:
+        uploads.append(track_upload(await ingest_upload(file, max_bytes=max_bytes, error=error.format(filename=file.filename))))
+    
+    return uploads
+
+
+# Accept type that asks a tool for its result bytes instead of JSON
+INLINE_MEDIA_TYPE = "application/octet-stream"
+
+# Result fields never copied into X- headers (the text preview is the body itself)
+INLINE_HEADER_SKIP = {"success", "extracted_text"}
+
+
+def wants_inline(request: Request) -> bool:
+    """True if the client asked for the result bytes (Accept: application/octet-stream or ?inline=1)"""
+    if request.query_params.get("inline", "").lower() in ("1", "true", "yes"):
+        return True
+    return INLINE_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def write_output(request: Request, path: Path, data: Union[bytes, str]):
+    """Write a tool result to outputs/ - skipped when the bytes go back inline"""
+    if wants_inline(request):
+        return
+    
+    if isinstance(data, str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def tool_response(
+    request: Request,
+    result: dict,
+    data: Union[bytes, str, Iterator[bytes], Path],
+    filename: str,
+    media_type: str = None
+):
+    """
+    Return a tool's JSON result, or the result bytes in direct-bytes mode.
+    
+    In direct-bytes mode the JSON fields become X-... response headers
+    (e.g. output_size -> X-Output-Size), minus URLs and nested values, and
+    nothing is left in outputs/ for a second download.
+    
+    Args:
+        request: Incoming request (checked with wants_inline)
+        result: JSON result for the normal mode
+        data: Result bytes/text, a chunk iterator, or a file to send and delete
+        filename: Download filename
+        media_type: Content type (guessed from filename if not given)
+    """
+    if not wants_inline(request):
+        return result
+    
+    media_type = media_type or mimetypes.guess_type(filename)[0] or INLINE_MEDIA_TYPE
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+    
+    for key, value in result.items():
+        if key in INLINE_HEADER_SKIP or key.endswith(("_url", "_urls")) or isinstance(value, (dict, list)) or value is None:
+            continue
+        header = "X-" + "-".join(part.capitalize() for part in key.split("_"))
+        headers[header] = quote(str(value), safe=" :/.,%+-()")
+    
+    if isinstance(data, Path):
+        return FileResponse(data, media_type=media_type, headers=headers, background=BackgroundTask(data.unlink))
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if isinstance(data, (bytes, bytearray)):
+        return Response(content=bytes(data), media_type=media_type, headers=headers)
+    return StreamingResponse(data, media_type=media_type, headers=headers)
+
+
+def decode_upload(upload: IngestedUpload) -> Image.Image:
+    """
+    Decode an uploaded image.
+    
+    For stored uploads the decoded pixels are cached (within the cache's
+    byte budget), so follow-up calls (crop/compress tweaks) skip the
+    decode. Tools must not modify the returned image in place.
+    """
+    image = upload.cache.get("image")
+    
+    if image is None:
+        image = decode_image(upload.stream())
+        if upload.upload_id:
+            image.load()
+            cache_large(upload, "image", image, image.width * image.height * len(image.getbands()))
+    
+    return image
+
+
 # Serve static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
@@ -145,6 +414,8 @@ async def startup():
                 file_age = current_time - file_path.stat().st_mtime
                 if file_age > max_age:
                     file_path.unlink()
+    
+    purge_expired_uploads()
 
 
 # ============================================================================
@@ -229,9 +500,262 @@ async def get_me(current_user: User = Depends(get_current_user)):
 # IMAGE PROCESSING ENDPOINTS
 # ============================================================================
 
+# Most headers (including EXIF/ICC blocks) fit in the first 64KB
+IMAGE_INFO_HEADER_BYTES = 64 * 1024
+
+
+@app.post("/api/image/info")
+async def image_info(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Read image format, dimensions, mode and frame count (FREE)
+    
+    Only the header is parsed - no pixels are decoded - so this is cheap
+    enough to call before choosing a tool or settings.
+    """
+    head = await file.read(IMAGE_INFO_HEADER_BYTES)
+    
+    try:
+        try:
+            info = probe_image(head, max_pixels=float("inf"))
+        except ImageTooLargeError:
+            raise
+        except ValueError:
+            # Header runs past the first chunk - read the rest (max 20MB)
+            rest = await file.read(20 * 1024 * 1024 + 1 - len(head))
+            if len(head) + len(rest) > 20 * 1024 * 1024:
+                raise HTTPException(status_code=400, detail="File too large. Max 20MB")
+            info = probe_image(head + rest, max_pixels=float("inf"))
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Unrecognised image file")
+    
+    return {
+        "success": True,
+        "format": info.format,
+        "width": info.width,
+        "height": info.height,
+        "mode": info.mode,
+        "frames": info.frames,
+        "megapixels": round(info.pixels / 1_000_000, 2),
+        "within_pixel_budget": info.pixels <= MAX_IMAGE_PIXELS
+    }
+
+
+# ============================================================================
+# UPLOAD SESSIONS
+# ============================================================================
+
+# Largest stored upload (the biggest any tool accepts - pdf-to-images)
+UPLOAD_STORE_MAX_BYTES = 100 * 1024 * 1024
+
+
+def describe_upload(upload: IngestedUpload) -> dict:
+    """Decoded metadata for a stored upload (image header or PDF page count)"""
+    if sniff_format(upload.head(SNIFF_BYTES)) == "PDF":
+        try:
+            from pypdf import PdfReader
+            pages = len(PdfReader(upload.stream()).pages)
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid or encrypted PDF")
+        return {"type": "pdf", "pages": pages}
+    
+    info = validate_image_upload(
+        upload.stream(),
+        allowed_formats=["JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF", "HEIF"],
+        error="Unsupported file. Upload an image or a PDF"
+    )
+    return {
+        "type": "image",
+        "format": info.format,
+        "width": info.width,
+        "height": info.height,
+        "mode": info.mode,
+        "frames": info.frames,
+    }
+
+
+@app.post("/api/uploads")
+async def create_upload(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Upload a file once and reference it by upload_id in tool calls (FREE)
+    
+    Every tool that takes a file also accepts upload_id, so interactive
+    sessions (crop/compress tweaks, blur detect-then-process) send the
+    bytes once. Stored uploads expire after an hour.
+    """
+    upload = await ingest_upload(file, max_bytes=UPLOAD_STORE_MAX_BYTES, error="File too large. Max 100MB")
+    
+    with upload:
+        metadata = describe_upload(upload)
+        record = store_upload(upload, current_user.id, metadata)
+    
+    return {
+        "success": True,
+        **{k: v for k, v in record.items() if k not in ("owner_id", "stored_as")},
+        "expires_in": UPLOAD_STORE_TTL
+    }
+
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Get a stored upload's metadata"""
+    try:
+        record = get_stored_upload(upload_id, current_user.id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    
+    return {k: v for k, v in record.items() if k not in ("owner_id", "stored_as")}
+
+
+@app.delete("/api/uploads/{upload_id}")
+async def delete_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Delete a stored upload before it expires"""
+    try:
+        get_stored_upload(upload_id, current_user.id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    
+    delete_stored_upload(upload_id)
+    return {"success": True}
+
+
+def resumable_headers(state: dict) -> dict:
+    """Progress headers for a resumable upload"""
+    return {
+        "Upload-Offset": str(state["offset"]),
+        "Upload-Length": str(state["length"]),
+        "Cache-Control": "no-store"
+    }
+
+
+def find_resumable(upload_id: str, user: User) -> dict:
+    """Get a resumable upload's state or raise 404"""
+    try:
+        return get_resumable(upload_id, user.id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+
+
+@app.post("/api/uploads/resumable")
+async def create_resumable_upload(
+    filename: str = Form(...),
+    length: int = Form(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Start a resumable upload (FREE)
+    
+    Protocol (tus-like):
+        1. POST here with filename and total length -> upload_id
+        2. PATCH /api/uploads/resumable/{upload_id} with the raw bytes of the
+           next chunk and an Upload-Offset header
+        3. After a dropped connection, HEAD the upload to get Upload-Offset
+           and resend from there
+        4. POST .../finalize -> the upload_id works in every tool
+    """
+    if length <= 0 or length > UPLOAD_STORE_MAX_BYTES:
+        raise HTTPException(status_code=400, detail="Invalid length. Max 100MB")
+    
+    state = create_resumable(current_user.id, Path(filename).name, length)
+    
+    return JSONResponse(
+        status_code=201,
+        content={"success": True, "upload_id": state["upload_id"], "offset": 0, "length": length},
+        headers=resumable_headers(state)
+    )
+
+
+@app.head("/api/uploads/resumable/{upload_id}")
+async def resumable_upload_offset(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Report how many bytes of a resumable upload have arrived"""
+    state = find_resumable(upload_id, current_user)
+    return Response(status_code=200, headers=resumable_headers(state))
+
+
+@app.patch("/api/uploads/resumable/{upload_id}")
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Append a chunk to a resumable upload
+    
+    The request body is the raw chunk; Upload-Offset must equal the current
+    offset (409 otherwise). Bytes go straight to disk with a running hash.
+    """
+    try:
+        state = await append_resumable(upload_id, current_user.id, upload_offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    except OffsetMismatchError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return Response(status_code=204, headers=resumable_headers(state))
+
+
+@app.post("/api/uploads/resumable/{upload_id}/finalize")
+async def finalize_resumable_upload(
+    upload_id: str,
+    sha256: str = Form(None),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Finish a resumable upload and make it usable as upload_id in any tool
+    
+    Args:
+        sha256: Optional hex digest of the whole file to verify against
+    """
+    find_resumable(upload_id, current_user)
+    
+    try:
+        upload = complete_resumable(upload_id, current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if sha256 and sha256.lower() != upload.sha256:
+        upload.close()
+        delete_resumable(upload_id)
+        raise HTTPException(status_code=400, detail="Checksum mismatch - upload discarded")
+    
+    try:
+        metadata = describe_upload(upload)
+    except HTTPException:
+        upload.close()
+        delete_resumable(upload_id)
+        raise
+    
+    record = finalize_resumable(upload, upload_id, current_user.id, metadata)
+    
+    return {
+        "success": True,
+        **{k: v for k, v in record.items() if k not in ("owner_id", "stored_as")},
+        "expires_in": UPLOAD_STORE_TTL
+    }
+
+
+@app.delete("/api/uploads/resumable/{upload_id}")
+async def cancel_resumable_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Abandon an unfinished resumable upload"""
+    find_resumable(upload_id, current_user)
+    delete_resumable(upload_id)
+    return {"success": True}
+
+
 @app.post("/api/remove-background", response_model=ProcessImageResponse)
 async def remove_background(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     format: str = Form("png"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -242,18 +766,11 @@ async def remove_background(
     This endpoint is FREE and always returns a watermarked preview.
     Use /api/download/{file_id} to get the clean version (costs 1 credit).
     """
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid file type. Allowed: {', '.join(allowed_types)}"
-        )
-    
     # Validate file size (max 10MB)
-    contents = await file.read()
-    if len(contents) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 10MB")
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=10 * 1024 * 1024, error="File too large. Max 10MB")
+    
+    # Validate file type
+    validate_image_upload(upload.stream(), error="Invalid file type. Allowed: JPG, PNG, WebP")
     
     try:
         start_time = datetime.utcnow()
@@ -262,12 +779,11 @@ async def remove_background(
         file_id = str(uuid.uuid4())
         
         # Save original file
-        input_path = UPLOAD_DIR / f"{file_id}_original{Path(file.filename).suffix}"
-        with open(input_path, "wb") as f:
-            f.write(contents)
+        input_path = UPLOAD_DIR / f"{file_id}_original{Path(upload.filename).suffix}"
+        upload.save_as(input_path)
         
         # Process image - remove background
-        input_image = Image.open(io.BytesIO(contents))
+        input_image = decode_upload(upload)
         output_image = remove(input_image)
         
         # Determine output format
@@ -275,35 +791,22 @@ async def remove_background(
         if output_format not in ["png", "jpg", "jpeg", "webp"]:
             output_format = "png"
         
-        # Save CLEAN version (for later download)
-        clean_filename = f"{file_id}_clean.{output_format}"
-        clean_path = OUTPUT_DIR / clean_filename
+        # CLEAN version (for later download) and watermarked PREVIEW,
+        # encoded together
+        # JPG doesn't support transparency - the codec adds a white background
+        def build_clean():
+            return encode_image(output_image, output_format)
         
-        if output_format in ["jpg", "jpeg"]:
-            # JPG doesn't support transparency, add white background
-            background = Image.new("RGB", output_image.size, (255, 255, 255))
-            background.paste(output_image, mask=output_image.split()[3] if len(output_image.split()) == 4 else None)
-            background.save(clean_path, format="JPEG", quality=95)
-        else:
-            output_image.save(clean_path, format=output_format.upper())
-        
-        # Add watermark for PREVIEW
-        watermarked_image = add_watermark(output_image)
+        def build_preview():
+            return render_preview(output_image)
         
-        # Save PREVIEW version (watermarked)
-        preview_filename = f"{file_id}_preview.{output_format}"
-        preview_path = OUTPUT_DIR / preview_filename
-        
-        if output_format in ["jpg", "jpeg"]:
-            background = Image.new("RGB", watermarked_image.size, (255, 255, 255))
-            background.paste(watermarked_image, mask=watermarked_image.split()[3] if len(watermarked_image.split()) == 4 else None)
-            background.save(preview_path, format="JPEG", quality=95)
-        else:
-            watermarked_image.save(preview_path, format=output_format.upper())
+        clean, preview = await build_artifacts(
+            OUTPUT_DIR, file_id, output_format, build_clean, build_preview, preview_ext="webp"
+        )
         
         # Get file sizes
-        original_size = os.path.getsize(input_path)
-        output_size = os.path.getsize(clean_path)
+        original_size = upload.size
+        output_size = clean.size
         
         # Calculate processing time
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
@@ -311,7 +814,7 @@ async def remove_background(
         # Record usage (but don't charge credit yet)
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format=output_format,
             original_size=original_size,
@@ -325,10 +828,10 @@ async def remove_background(
         return ProcessImageResponse(
             success=True,
             file_id=file_id,
-            output_url=f"/outputs/{preview_filename}",  # Watermarked preview
+            output_url=f"/outputs/{preview.filename}",  # Watermarked preview
             download_url=f"/api/download/{file_id}",     # Clean version (costs credit)
-            original_filename=file.filename,
-            output_filename=preview_filename,
+            original_filename=upload.filename,
+            output_filename=preview.filename,
             original_size=original_size,
             output_size=output_size,
             format=output_format,
@@ -357,7 +860,7 @@ async def download_file(
     check_user_has_credits(current_user)
     
     # Find clean file
-    for ext in ["png", "jpg", "jpeg", "webp"]:
+    for ext in ["png", "jpg", "jpeg", "webp", "avif"]:
         file_path = OUTPUT_DIR / f"{file_id}_clean.{ext}"
         if file_path.exists():
             # Deduct credit
@@ -505,6 +1008,52 @@ async def list_users(db: Session = Depends(get_db)):
     } for u in users]
 
 
+# Accounts allowed to change runtime settings (comma-separated emails)
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+
+def require_admin(user: User):
+    """Raise 403 unless the user is listed in ADMIN_EMAILS"""
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+@app.get("/api/admin/encoder-policy")
+async def get_encoder_policy(current_user: User = Depends(get_current_user)):
+    """Show encode latency budgets and the effort ladders they select from"""
+    require_admin(current_user)
+    return {
+        "budgets_ms": ENCODE_BUDGETS_MS,
+        "effort_ladders": {
+            fmt: [{"options": options, "ms_per_megapixel": cost} for options, cost in ladder]
+            for fmt, ladder in EFFORT_LADDERS.items()
+        }
+    }
+
+
+@app.put("/api/admin/encoder-policy/{name}")
+async def update_encode_budget(
+    name: str,
+    budget_ms: int = Form(...),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Change an endpoint's encode latency budget without a restart
+    
+    Args:
+        name: Budget name (default, compress, preview, ...)
+        budget_ms: New budget in milliseconds
+    """
+    require_admin(current_user)
+    
+    try:
+        set_encode_budget(name, budget_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"success": True, "budgets_ms": ENCODE_BUDGETS_MS}
+
+
 # ============================================================================
 # API KEY MANAGEMENT (Pro & Business tiers only)
 # ============================================================================
@@ -604,7 +1153,8 @@ async def revoke_api_key(
 
 @app.post("/api/v1/remove-background")
 async def api_remove_background(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     format: str = Form("png"),
     current_user: User = Depends(get_current_user_from_api_key),
     db: Session = Depends(get_db)
@@ -623,15 +1173,11 @@ async def api_remove_background(
     # Check credits
     check_user_has_credits(current_user)
     
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid file type")
-    
     # Read file
-    contents = await file.read()
-    if len(contents) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 10MB")
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=10 * 1024 * 1024, error="File too large. Max 10MB")
+    
+    # Validate file type
+    validate_image_upload(upload.stream())
     
     try:
         start_time = datetime.utcnow()
@@ -640,12 +1186,11 @@ async def api_remove_background(
         file_id = str(uuid.uuid4())
         
         # Save original
-        input_path = UPLOAD_DIR / f"{file_id}_api_original{Path(file.filename).suffix}"
-        with open(input_path, "wb") as f:
-            f.write(contents)
+        input_path = UPLOAD_DIR / f"{file_id}_api_original{Path(upload.filename).suffix}"
+        upload.save_as(input_path)
         
         # Process image
-        input_image = Image.open(io.BytesIO(contents))
+        input_image = decode_upload(upload)
         output_image = remove(input_image)
         
         # Determine format
@@ -656,13 +1201,8 @@ async def api_remove_background(
         # Save clean version (NO WATERMARK for API)
         output_filename = f"{file_id}_api.{output_format}"
         output_path = OUTPUT_DIR / output_filename
-        
-        if output_format in ["jpg", "jpeg"]:
-            background = Image.new("RGB", output_image.size, (255, 255, 255))
-            background.paste(output_image, mask=output_image.split()[3] if len(output_image.split()) == 4 else None)
-            background.save(output_path, format="JPEG", quality=95)
-        else:
-            output_image.save(output_path, format=output_format.upper())
+        with open(output_path, "wb") as f:
+            f.write(encode_image(output_image, output_format))
         
         # Get sizes
         original_size = os.path.getsize(input_path)
@@ -675,7 +1215,7 @@ async def api_remove_background(
         # Record usage
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format=output_format,
             original_size=original_size,
@@ -704,11 +1244,12 @@ async def api_remove_background(
 # QR CODE GENERATOR
 # ============================================================================
 
-from tools import generate_qr_code, resize_image, bulk_resize_images, merge_pdfs, split_pdf, compress_pdf, images_to_pdf, pdf_to_images
+from tools import generate_qr_code, resize_image, bulk_resize_images, iter_bulk_resize_images, generate_image_variants, compress_to_target, auto_format_compress, quantize_png, AUTO_FORMAT_MIN_SSIM, RESIZE_SPEEDS, merge_pdfs_to_file, compress_pdf, PDF_COMPRESS_PRESETS, images_to_pdf, open_pdf_split, iter_pdf_pages, pdf_page_count, parse_page_numbers, pdf_to_docx, pdf_to_xlsx, iter_pdf_ocr, ocr_image
 from blur_functions import blur_image, detect_faces
 
 @app.post("/api/qr-code/generate")
 async def generate_qr(
+    request: Request,
     data: str = Form(...),
     size: int = Form(300),
     error_correction: str = Form("M"),
@@ -735,8 +1276,7 @@ async def generate_qr(
         output_path = OUTPUT_DIR / output_filename
         
         # Save file
-        with open(output_path, "wb") as f:
-            f.write(qr_bytes)
+        write_output(request, output_path, qr_bytes)
         
         # Deduct credit
         current_user.use_credit()
@@ -755,13 +1295,18 @@ async def generate_qr(
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            qr_bytes,
+            output_filename
+        )
         
     except Exception as e:
         db.rollback()
@@ -770,6 +1315,7 @@ async def generate_qr(
 
 @app.post("/api/barcode/generate")
 async def generate_barcode_endpoint(
+    request: Request,
     data: str = Form(...),
     barcode_type: str = Form("code128"),
     show_text: bool = Form(True),
@@ -839,8 +1385,7 @@ async def generate_barcode_endpoint(
         output_path = OUTPUT_DIR / output_filename
         
         # Save file
-        with open(output_path, "wb") as f:
-            f.write(barcode_bytes)
+        write_output(request, output_path, barcode_bytes)
         
         # Deduct credit
         current_user.use_credit()
@@ -859,14 +1404,19 @@ async def generate_barcode_endpoint(
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "barcode_type": barcode_type,
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "barcode_type": barcode_type,
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            barcode_bytes,
+            output_filename
+        )
         
     except HTTPException:
         raise
@@ -881,26 +1431,30 @@ async def generate_barcode_endpoint(
 
 @app.post("/api/resize/single")
 async def resize_single_image(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     width: int = Form(None),
     height: int = Form(None),
     format: str = Form("png"),
     maintain_aspect: str = Form("true"),
+    speed: str = Form("auto"),
     current_user: User = Depends(require_credits),
     db: Session = Depends(get_db)
 ):
     """
     Resize a single image (costs 1 credit)
+    
+    Args:
+        speed: auto (fast path for large downscales), fast, or quality
     """
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid file type")
+    if speed not in RESIZE_SPEEDS:
+        raise HTTPException(status_code=400, detail=f"Invalid speed. Allowed: {', '.join(RESIZE_SPEEDS)}")
     
-    contents = await file.read()
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=10 * 1024 * 1024, error="File too large. Max 10MB")
     
-    if len(contents) > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 10MB")
+    # Validate file type
+    validate_image_upload(upload.stream())
     
     # Convert string to boolean
     maintain_aspect_bool = maintain_aspect.lower() == "true"
@@ -909,7 +1463,7 @@ async def resize_single_image(
         start_time = datetime.utcnow()
         
         # Resize image
-        resized_bytes = resize_image(contents, width=width, height=height, maintain_aspect=maintain_aspect_bool, format=format)
+        resized_bytes = resize_image(upload.stream(), width=width, height=height, maintain_aspect=maintain_aspect_bool, format=format, speed=speed)
         
         # Save file
         file_id = str(uuid.uuid4())
@@ -917,8 +1471,7 @@ async def resize_single_image(
         output_filename = f"{file_id}_resized.{ext}"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(resized_bytes)
+        write_output(request, output_path, resized_bytes)
         
         # Deduct credit
         current_user.use_credit()
@@ -927,38 +1480,295 @@ async def resize_single_image(
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format=format,
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=len(resized_bytes),
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "original_size": len(contents),
-            "output_size": len(resized_bytes),
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "original_size": upload.size,
+                "output_size": len(resized_bytes),
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            resized_bytes,
+            output_filename
+        )
         
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Resize error: {str(e)}")
 
 
+# Limits for bulk resize (per image, per ZIP archive, images per batch)
+BULK_RESIZE_MAX_IMAGE_BYTES = 10 * 1024 * 1024
+BULK_RESIZE_MAX_ZIP_BYTES = 100 * 1024 * 1024
+BULK_RESIZE_MAX_FILES = 200
+
+
+@app.post("/api/resize/bulk")
+async def resize_bulk_images(
+    files: List[UploadFile] = File(None),
+    upload_ids: str = Form(None),
+    width: int = Form(None),
+    height: int = Form(None),
+    format: str = Form("png"),
+    maintain_aspect: str = Form("true"),
+    speed: str = Form("auto"),
+    current_user: User = Depends(require_credits),
+    db: Session = Depends(get_db)
+):
+    """
+    Resize many images at once (costs 1 credit)
+    
+    Accepts several image files and/or ZIP archives of images. Images are
+    resized in parallel and streamed back as a ZIP as each one finishes.
+    Images that fail are listed in errors.txt inside the archive.
+    Stored uploads can be passed as comma-separated upload_ids.
+    """
+    if speed not in RESIZE_SPEEDS:
+        raise HTTPException(status_code=400, detail=f"Invalid speed. Allowed: {', '.join(RESIZE_SPEEDS)}")
+    
+    if format.lower() not in ["png", "jpg", "jpeg", "webp"]:
+        raise HTTPException(status_code=400, detail="Invalid format. Allowed: png, jpg, webp")
+    
+    maintain_aspect_bool = maintain_aspect.lower() == "true"
+    
+    # Collect sources: plain images, or entries inside uploaded ZIPs
+    sources = []  # (filename, upload, zip archive, zip entry)
+    total_size = 0
+    
+    uploads = await resolve_uploads(
+        files, upload_ids, current_user,
+        max_bytes=BULK_RESIZE_MAX_ZIP_BYTES, error="File too large: {filename}"
+    )
+    
+    for upload in uploads:
+        total_size += upload.size
+        
+        if upload.head(4) == b"PK\x03\x04":
+            try:
+                archive = zipfile.ZipFile(upload.stream())
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Invalid ZIP file: {upload.filename}")
+            
+            for info in archive.infolist():
+                name = Path(info.filename).name
+                if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX"):
+                    continue
+                if info.file_size > BULK_RESIZE_MAX_IMAGE_BYTES:
+                    raise HTTPException(status_code=400, detail=f"Image too large in ZIP: {name}. Max 10MB")
+                sources.append((name, upload, archive, info))
+        else:
+            if upload.size > BULK_RESIZE_MAX_IMAGE_BYTES:
+                raise HTTPException(status_code=400, detail=f"Image too large: {upload.filename}. Max 10MB")
+            validate_image_upload(upload.stream(), error=f"Invalid image file: {upload.filename}")
+            sources.append((upload.filename, upload, None, None))
+    
+    if not sources:
+        raise HTTPException(status_code=400, detail="No images found")
+    
+    if len(sources) > BULK_RESIZE_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many images. Max {BULK_RESIZE_MAX_FILES} per batch")
+    
+    file_id = str(uuid.uuid4())
+    
+    # Charge up front - the response is streamed, so there is no later point to do it
+    current_user.use_credit()
+    usage_record = UsageRecord(
+        user_id=current_user.id,
+        original_filename=f"bulk_resize_{len(sources)}_images",
+        file_id=file_id,
+        output_format="zip",
+        original_size=total_size,
+        processing_time=0
+    )
+    db.add(usage_record)
+    db.commit()
+    
+    def iter_sources():
+        # ZIP entries are only read when a worker slot frees up
+        for name, upload, archive, info in sources:
+            if archive is None:
+                yield name, upload.stream()
+            else:
+                yield name, archive.read(info)
+    
+    def iter_entries():
+        used_names = set()
+        errors = []
+        
+        for name, result in iter_bulk_resize_images(
+            iter_sources(),
+            width=width,
+            height=height,
+            maintain_aspect=maintain_aspect_bool,
+            format=format,
+            speed=speed
+        ):
+            if isinstance(result, Exception):
+                errors.append(f"{name}: {result}")
+                continue
+            
+            # Same filename from different folders/uploads - keep both
+            unique_name = name
+            counter = 1
+            while unique_name in used_names:
+                stem, ext = os.path.splitext(name)
+                unique_name = f"{stem}_{counter}{ext}"
+                counter += 1
+            used_names.add(unique_name)
+            
+            yield unique_name, result
+        
+        if errors:
+            yield "errors.txt", "\n".join(errors).encode("utf-8")
+    
+    # Images are already compressed - iter_zip stores them, deflates errors.txt
+    return StreamingResponse(
+        iter_zip(iter_entries()),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="resized_{file_id[:8]}.zip"',
+            "X-Images-Count": str(len(sources)),
+            "X-Credits-Remaining": str(current_user.credits_remaining)
+        }
+    )
+
+
+# Limits for responsive variants
+VARIANTS_MAX_WIDTHS = 10
+VARIANTS_WIDTH_RANGE = (16, 8192)
+
+
+@app.post("/api/resize/variants")
+async def resize_image_variants(
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    widths: str = Form("320,640,1280,1920"),
+    formats: str = Form("webp,jpg"),
+    quality: int = Form(82),
+    current_user: User = Depends(require_credits),
+    db: Session = Depends(get_db)
+):
+    """
+    Generate a responsive image set from one upload (costs 1 credit)
+    
+    Args:
+        widths: Comma-separated target widths, e.g. "320,640,1280,1920"
+        formats: Comma-separated output formats (jpg, png, webp)
+        quality: Output quality 1-100 for JPG/WebP
+    
+    Returns a ZIP of every width x format variant plus manifest.json,
+    and the same manifest (with ready-made srcset strings) in the response.
+    """
+    try:
+        width_list = [int(w) for w in widths.split(",") if w.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Widths must be comma-separated integers")
+    
+    if not width_list or len(width_list) > VARIANTS_MAX_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"Provide 1-{VARIANTS_MAX_WIDTHS} widths")
+    
+    if any(not VARIANTS_WIDTH_RANGE[0] <= w <= VARIANTS_WIDTH_RANGE[1] for w in width_list):
+        raise HTTPException(status_code=400, detail=f"Widths must be between {VARIANTS_WIDTH_RANGE[0]} and {VARIANTS_WIDTH_RANGE[1]}")
+    
+    format_list = [f.strip().lower() for f in formats.split(",") if f.strip()]
+    if not format_list or any(f not in ["png", "jpg", "jpeg", "webp"] for f in format_list):
+        raise HTTPException(status_code=400, detail="Formats must be from: png, jpg, webp")
+    
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
+    
+    # Validate file type
+    validate_image_upload(upload.stream(), error="Invalid image format. Supported: JPG, PNG, WebP")
+    
+    try:
+        start_time = datetime.utcnow()
+        
+        original_name = Path(upload.filename).stem
+        variants, manifest = generate_image_variants(
+            upload.stream(),
+            widths=width_list,
+            formats=format_list,
+            quality=quality,
+            base_name=original_name
+        )
+        
+        # Save ZIP with every variant and the manifest
+        file_id = str(uuid.uuid4())
+        zip_filename = f"{original_name}_variants_{file_id[:8]}.zip"
+        zip_path = OUTPUT_DIR / zip_filename
+        
+        entries = variants + [("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))]
+        zip_chunks = iter_zip(entries)
+        
+        # Inline responses stream the archive as it is built, so its size isn't known up front
+        zip_size = None
+        if not wants_inline(request):
+            with open(zip_path, "wb") as f:
+                for chunk in zip_chunks:
+                    f.write(chunk)
+            zip_size = os.path.getsize(zip_path)
+        
+        # Deduct credit
+        current_user.use_credit()
+        
+        # Record usage
+        processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
+        usage_record = UsageRecord(
+            user_id=current_user.id,
+            original_filename=upload.filename,
+            file_id=file_id,
+            output_format="zip",
+            original_size=upload.size,
+            output_size=zip_size or sum(len(data) for _, data in variants),
+            processing_time=processing_time
+        )
+        db.add(usage_record)
+        db.commit()
+        
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{zip_filename}",
+                "variants_count": len(variants),
+                "manifest": manifest,
+                "original_size": upload.size,
+                "zip_size": zip_size,
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            zip_chunks,
+            zip_filename
+        )
+        
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Variants error: {str(e)}")
+
+
 # ============================================================================
 # IMAGE FORMAT CONVERTER
 # ============================================================================
 
 @app.post("/api/convert/format")
 async def convert_image_format(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     to_format: str = Form(...),
     quality: int = Form(100),
     current_user: User = Depends(require_credits),
@@ -971,61 +1781,38 @@ async def convert_image_format(
         to_format: Target format (png, jpg, webp, bmp, tiff)
         quality: Output quality 1-100 (for lossy formats like JPG/WebP only)
     """
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp", "image/bmp", "image/tiff", "image/heic"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid image format")
-    
     # Validate target format
     to_format = to_format.lower()
     valid_formats = ["png", "jpg", "jpeg", "webp", "bmp", "tiff"]
     if to_format not in valid_formats:
         raise HTTPException(status_code=400, detail=f"Invalid target format. Allowed: {', '.join(valid_formats)}")
     
-    contents = await file.read()
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 20MB")
+    # Validate file type
+    source_info = validate_image_upload(
+        upload.stream(),
+        allowed_formats=["JPEG", "PNG", "WEBP", "BMP", "TIFF", "HEIF"],
+        error="Invalid image format"
+    )
     
     try:
         start_time = datetime.utcnow()
         
         # Open image
-        input_image = Image.open(io.BytesIO(contents))
-        
-        # Convert RGBA to RGB if saving as JPEG
-        if to_format in ["jpg", "jpeg"] and input_image.mode in ["RGBA", "LA", "P"]:
-            # Create white background
-            rgb_image = Image.new("RGB", input_image.size, (255, 255, 255))
-            if input_image.mode == "P":
-                input_image = input_image.convert("RGBA")
-            rgb_image.paste(input_image, mask=input_image.split()[-1] if input_image.mode in ["RGBA", "LA"] else None)
-            input_image = rgb_image
-        
-        # Save in new format
-        output_buffer = io.BytesIO()
-        save_format = "JPEG" if to_format in ["jpg", "jpeg"] else to_format.upper()
-        
-        # Quality settings
-        save_kwargs = {}
-        if to_format in ["jpg", "jpeg", "webp"]:
-            save_kwargs["quality"] = min(max(quality, 1), 100)
-            save_kwargs["optimize"] = True
-        elif to_format == "png":
-            save_kwargs["optimize"] = True
-        
-        input_image.save(output_buffer, format=save_format, **save_kwargs)
-        output_bytes = output_buffer.getvalue()
+        input_image = decode_upload(upload)
+        
+        # Save in new format (quality only applies to lossy formats like JPG/WebP)
+        output_bytes = encode_image(input_image, to_format, quality=quality)
         
         # Save file
         file_id = str(uuid.uuid4())
         ext = "jpg" if to_format == "jpeg" else to_format
-        original_name = Path(file.filename).stem
+        original_name = Path(upload.filename).stem
         output_filename = f"{original_name}_converted_{file_id[:8]}.{ext}"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(output_bytes)
+        write_output(request, output_path, output_bytes)
         
         # Deduct credit
         current_user.use_credit()
@@ -1034,28 +1821,33 @@ async def convert_image_format(
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format=to_format,
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=len(output_bytes),
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "original_format": file.content_type.split("/")[-1],
-            "output_format": ext,
-            "original_size": len(contents),
-            "output_size": len(output_bytes),
-            "size_change_percent": round((len(output_bytes) - len(contents)) / len(contents) * 100, 1),
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "original_format": source_info.format.lower(),
+                "output_format": ext,
+                "original_size": upload.size,
+                "output_size": len(output_bytes),
+                "size_change_percent": round((len(output_bytes) - upload.size) / upload.size * 100, 1),
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            output_bytes,
+            output_filename
+        )
         
     except Exception as e:
         db.rollback()
@@ -1066,10 +1858,55 @@ async def convert_image_format(
 # IMAGE COMPRESSION
 # ============================================================================
 
+# Image media types in an Accept header -> auto_format candidates
+ACCEPT_FORMAT_CANDIDATES = {
+    "image/avif": "AVIF",
+    "image/webp": "WEBP",
+    "image/jpeg": "JPEG",
+    "image/png": "PNG8",
+}
+
+# Candidates used when the client names no image types
+DEFAULT_AUTO_FORMATS = ["WEBP", "JPEG", "PNG8"]
+
+
+def auto_format_candidates(accept: str = None, formats: str = None) -> List[str]:
+    """
+    Work out which formats the auto_format race may produce.
+    
+    An explicit formats list (e.g. "avif,webp,jpg,png") wins; otherwise the
+    image types named in the Accept header are used. JPEG and PNG are always
+    allowed once the client names any image type.
+    """
+    if formats:
+        candidates = []
+        for name in formats.split(","):
+            fmt = normalize_format(name.strip(), default=None)
+            if fmt not in ("AVIF", "WEBP", "JPEG", "PNG"):
+                raise HTTPException(status_code=400, detail=f"Unsupported format: {name.strip()}")
+            candidates.append("PNG8" if fmt == "PNG" else fmt)
+        return candidates
+    
+    accepted = [
+        candidate for media_type, candidate in ACCEPT_FORMAT_CANDIDATES.items()
+        if media_type in (accept or "")
+    ]
+    if not accepted:
+        return DEFAULT_AUTO_FORMATS
+    return sorted(set(accepted) | {"JPEG", "PNG8"})
+
+
 @app.post("/api/compress/image")
 async def compress_image(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     quality: int = Form(85),
+    target_bytes: int = Form(None),
+    min_ssim: float = Form(None),
+    auto_format: bool = Form(False),
+    formats: str = Form(None),
+    dither: bool = Form(False),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1077,109 +1914,139 @@ async def compress_image(
     Compress image - Preview FREE, download costs 1 credit
     
     Args:
-        quality: Compression quality 1-100 (default 85 = good balance)
+        quality: Compression quality 1-100 (default 85 = good balance).
+            For PNG this sets how many colours are kept; 100 = lossless
+        target_bytes: Instead of quality - best quality that fits this size (JPG/WebP)
+        min_ssim: Instead of quality - smallest file with at least this similarity, 0-1 (JPG/WebP)
+        auto_format: Race AVIF/WebP/JPG/palette PNG and keep the smallest that
+            still looks right (min_ssim is the floor, default 0.95)
+        formats: Formats auto_format may pick, e.g. "webp,jpg,png"
+            (default: image types in the Accept header)
+        dither: Dither quantized PNGs (smoother photos, larger graphics)
     
     Returns preview with watermark. Use /api/download/{file_id} to get clean version.
     """
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported: JPG, PNG, WebP")
+    if target_bytes is not None and min_ssim is not None:
+        raise HTTPException(status_code=400, detail="Use either target_bytes or min_ssim, not both")
+    
+    if auto_format and target_bytes is not None:
+        raise HTTPException(status_code=400, detail="target_bytes cannot be combined with auto_format")
+    
+    candidates = auto_format_candidates(request.headers.get("accept"), formats) if auto_format else None
     
-    contents = await file.read()
+    if target_bytes is not None and target_bytes < 1024:
+        raise HTTPException(status_code=400, detail="target_bytes must be at least 1024")
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 20MB")
+    if min_ssim is not None and not 0 < min_ssim < 1:
+        raise HTTPException(status_code=400, detail="min_ssim must be between 0 and 1")
+    
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
+    
+    # Validate file type
+    validate_image_upload(upload.stream(), error="Invalid image format. Supported: JPG, PNG, WebP")
     
     try:
         start_time = datetime.utcnow()
         
         # Open image
-        input_image = Image.open(io.BytesIO(contents))
-        original_format = input_image.format or "JPEG"
+        input_image = decode_upload(upload)
         
-        # Determine output format (keep original)
-        if original_format.upper() in ["JPEG", "JPG"]:
+        # Determine output format (keep original, JPEG for anything else)
+        output_format = normalize_format(input_image.format, default="JPEG")
+        if output_format not in ["JPEG", "PNG", "WEBP"]:
             output_format = "JPEG"
-            ext = "jpg"
-        elif original_format.upper() == "PNG":
-            output_format = "PNG"
-            ext = "png"
-        elif original_format.upper() == "WEBP":
-            output_format = "WEBP"
-            ext = "webp"
-        else:
-            output_format = "JPEG"
-            ext = "jpg"
-        
-        # Convert RGBA to RGB if needed for JPEG
-        if output_format == "JPEG" and input_image.mode in ["RGBA", "LA", "P"]:
-            rgb_image = Image.new("RGB", input_image.size, (255, 255, 255))
-            if input_image.mode == "P":
-                input_image = input_image.convert("RGBA")
-            rgb_image.paste(input_image, mask=input_image.split()[-1] if input_image.mode in ["RGBA", "LA"] else None)
-            input_image = rgb_image
-        
-        # Compress with quality settings
-        output_buffer = io.BytesIO()
-        save_kwargs = {
-            "optimize": True,
-            "quality": min(max(quality, 1), 100)
-        }
         
-        # PNG-specific optimization
-        if output_format == "PNG":
-            # For PNG, quality doesn't apply but we can optimize
-            # Lower quality means more aggressive optimization
-            save_kwargs.pop("quality")
-            save_kwargs["compress_level"] = 9  # Maximum compression
+        search = None
+        race = None
+        palette = None
+        
+        if auto_format:
+            # Encode every candidate format and keep the smallest good one
+            # (several encodes + SSIM passes - kept off the event loop)
+            race = await run_in_threadpool(
+                auto_format_compress,
+                input_image, quality=quality, formats=candidates,
+                min_ssim=min_ssim if min_ssim is not None else AUTO_FORMAT_MIN_SSIM
+            )
+            output_bytes = race.data
+            output_format = race.format
+        elif target_bytes is not None or min_ssim is not None:
+            # Search for the quality that meets the size/similarity goal
+            if output_format == "PNG":
+                raise HTTPException(status_code=400, detail="target_bytes and min_ssim need a JPG or WebP image")
+            search = await run_in_threadpool(
+                compress_to_target, input_image, output_format, target_bytes=target_bytes, min_ssim=min_ssim
+            )
+            output_bytes = search.data
+            quality = search.quality
+        elif output_format == "PNG" and quality < 100:
+            # Lossy PNG - fewest palette colours that keep the quality
+            palette = await run_in_threadpool(quantize_png, input_image, quality=quality, dither=dither)
+            output_bytes = palette.data
+        else:
+            # Plain quality setting - encoded below, alongside the preview
+            output_bytes = None
         
-        input_image.save(output_buffer, format=output_format, **save_kwargs)
-        output_bytes = output_buffer.getvalue()
+        ext = format_extension(output_format)
         
         # Generate file ID
         file_id = str(uuid.uuid4())
-        original_name = Path(file.filename).stem
-        
-        # Save CLEAN version (for download later)
-        clean_filename = f"{file_id}_clean.{ext}"
-        clean_path = OUTPUT_DIR / clean_filename
-        with open(clean_path, "wb") as f:
-            f.write(output_bytes)
-        
-        # Create PREVIEW version (with watermark)
-        compressed_image = Image.open(io.BytesIO(output_bytes))
-        watermarked_image = add_watermark(compressed_image)
-        
-        # Convert RGBA back to RGB for JPEG (watermark adds alpha channel)
-        if output_format == "JPEG" and watermarked_image.mode == "RGBA":
-            rgb_image = Image.new("RGB", watermarked_image.size, (255, 255, 255))
-            rgb_image.paste(watermarked_image, mask=watermarked_image.split()[-1])
-            watermarked_image = rgb_image
+        original_name = Path(upload.filename).stem
+        
+        if output_bytes is None:
+            # CLEAN version at the requested quality (lossless for PNG 100),
+            # with the most encoder effort the compress budget allows.
+            # PREVIEW downsamples the source and encodes it at the same
+            # quality, so it still shows the compression.
+            input_image.load()
+            
+            def build_clean():
+                return encode_image(input_image, output_format, quality=quality, budget="compress")
+            
+            def build_preview():
+                return render_preview(input_image, fmt=output_format, quality=quality)
+        else:
+            # CLEAN version came out of the search - PREVIEW is a
+            # downsampled copy of it
+            def build_clean():
+                return output_bytes
+            
+            def build_preview():
+                return render_preview(decode_image(output_bytes), fmt=output_format, quality=quality)
         
-        preview_filename = f"{file_id}_preview.{ext}"
-        preview_path = OUTPUT_DIR / preview_filename
-        watermarked_image.save(preview_path, format=output_format, **save_kwargs)
+        clean, preview = await build_artifacts(OUTPUT_DIR, file_id, ext, build_clean, build_preview)
         
         # Calculate savings
-        size_reduction = len(contents) - len(output_bytes)
-        reduction_percent = round((size_reduction / len(contents)) * 100, 1)
+        size_reduction = upload.size - clean.size
+        reduction_percent = round((size_reduction / upload.size) * 100, 1)
         
         # NO credit deduction yet - only on download!
+        outcome = search or race or palette
         
         return {
             "success": True,
             "file_id": file_id,
-            "preview_url": f"/outputs/{preview_filename}",
+            "preview_url": f"/outputs/{preview.filename}",
             "download_url": f"/api/download/{file_id}",
-            "original_size": len(contents),
-            "compressed_size": len(output_bytes),
+            "original_size": upload.size,
+            "compressed_size": clean.size,
             "size_reduction": size_reduction,
             "reduction_percent": reduction_percent,
+            "compression_ratio": round(upload.size / clean.size, 2) if clean.size else None,
+            "preview_size": preview.size,
+            "format": ext,
+            "chosen_quality": quality if output_format != "PNG" else None,
+            "encodes_tried": search.encodes if search else race.finished if race else 1,
+            "ssim": round(outcome.ssim, 4) if outcome and outcome.ssim is not None else None,
+            "target_met": search.target_met if search else race.target_met if race else None,
+            "stopped_early": race.stopped_early if race else None,
+            "palette_colors": palette.colors if palette else None,
             "credits_remaining": current_user.credits_remaining,
             "timestamp": datetime.utcnow()
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Compression error: {str(e)}")
@@ -1187,7 +2054,8 @@ async def compress_image(
 
 @app.post("/api/watermark/add")
 async def add_custom_watermark(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     text: str = Form(...),
     position: str = Form("tiled"),
     opacity: int = Form(60),
@@ -1204,15 +2072,10 @@ async def add_custom_watermark(
     
     Returns preview with your watermark. Use /api/download/{file_id} to get full version.
     """
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported: JPG, PNG, WebP")
-    
-    contents = await file.read()
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 20MB")
+    # Validate file type
+    validate_image_upload(upload.stream(), error="Invalid image format. Supported: JPG, PNG, WebP")
     
     if not text or len(text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Watermark text is required")
@@ -1227,7 +2090,7 @@ async def add_custom_watermark(
         start_time = datetime.utcnow()
         
         # Open image
-        input_image = Image.open(io.BytesIO(contents))
+        input_image = decode_upload(upload)
         original_format = input_image.format or "PNG"
         
         # Convert to RGBA for watermarking
@@ -1242,66 +2105,37 @@ async def add_custom_watermark(
             opacity
         )
         
-        # Determine output format
-        if original_format.upper() in ["JPEG", "JPG"]:
-            output_format = "JPEG"
-            ext = "jpg"
-            # Convert to RGB for JPEG
-            rgb_image = Image.new("RGB", watermarked_image.size, (255, 255, 255))
-            rgb_image.paste(watermarked_image, mask=watermarked_image.split()[-1])
-            watermarked_image = rgb_image
-        elif original_format.upper() == "PNG":
+        # Determine output format (keep original, PNG for anything else)
+        output_format = normalize_format(original_format)
+        if output_format not in ["JPEG", "PNG", "WEBP"]:
             output_format = "PNG"
-            ext = "png"
-        elif original_format.upper() == "WEBP":
-            output_format = "WEBP"
-            ext = "webp"
-        else:
-            output_format = "PNG"
-            ext = "png"
-        
-        # Save watermarked version
-        output_buffer = io.BytesIO()
-        save_kwargs = {"optimize": True}
-        if output_format == "JPEG":
-            save_kwargs["quality"] = 95
-        
-        watermarked_image.save(output_buffer, format=output_format, **save_kwargs)
-        output_bytes = output_buffer.getvalue()
+        ext = format_extension(output_format)
         
         # Generate file ID
         file_id = str(uuid.uuid4())
-        original_name = Path(file.filename).stem
+        original_name = Path(upload.filename).stem
         
-        # Save CLEAN version (full quality watermarked - for download)
-        clean_filename = f"{file_id}_clean.{ext}"
-        clean_path = OUTPUT_DIR / clean_filename
-        with open(clean_path, "wb") as f:
-            f.write(output_bytes)
+        # CLEAN version (full quality watermarked - for download) and
+        # PREVIEW version (lower quality + preview watermark), encoded together
+        def build_clean():
+            return encode_image(watermarked_image, output_format)
         
-        # Create PREVIEW version (lower quality + preview watermark)
-        preview_watermarked = add_watermark(watermarked_image, "PREVIEW")
+        def build_preview():
+            return render_preview(watermarked_image, "PREVIEW")
         
-        preview_filename = f"{file_id}_preview.{ext}"
-        preview_path = OUTPUT_DIR / preview_filename
-        
-        # Convert to RGB if needed for JPEG preview
-        if output_format == "JPEG" and preview_watermarked.mode == "RGBA":
-            rgb_preview = Image.new("RGB", preview_watermarked.size, (255, 255, 255))
-            rgb_preview.paste(preview_watermarked, mask=preview_watermarked.split()[-1])
-            preview_watermarked = rgb_preview
-        
-        preview_watermarked.save(preview_path, format=output_format, quality=85 if output_format == "JPEG" else None)
+        clean, preview = await build_artifacts(
+            OUTPUT_DIR, file_id, ext, build_clean, build_preview, preview_ext="webp"
+        )
         
         # NO credit deduction yet - only on download!
         
         return {
             "success": True,
             "file_id": file_id,
-            "preview_url": f"/outputs/{preview_filename}",
+            "preview_url": f"/outputs/{preview.filename}",
             "download_url": f"/api/download/{file_id}",
-            "original_size": len(contents),
-            "watermarked_size": len(output_bytes),
+            "original_size": upload.size,
+            "watermarked_size": clean.size,
             "watermark_text": text,
             "position": position,
             "credits_remaining": current_user.credits_balance,
@@ -1417,7 +2251,8 @@ def apply_custom_watermark(image: Image.Image, text: str, position: str, opacity
 
 @app.post("/api/crop/image")
 async def crop_image(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     x: int = Form(...),
     y: int = Form(...),
     width: int = Form(...),
@@ -1436,21 +2271,16 @@ async def crop_image(
     
     Returns preview with watermark. Use /api/download/{file_id} to get clean version.
     """
-    # Validate file type
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="Invalid image format. Supported: JPG, PNG, WebP")
-    
-    contents = await file.read()
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 20MB")
+    # Validate file type
+    validate_image_upload(upload.stream(), error="Invalid image format. Supported: JPG, PNG, WebP")
     
     try:
         start_time = datetime.utcnow()
         
         # Open image
-        input_image = Image.open(io.BytesIO(contents))
+        input_image = decode_upload(upload)
         original_format = input_image.format or "JPEG"
         original_width, original_height = input_image.size
         
@@ -1464,62 +2294,29 @@ async def crop_image(
         # Crop image using provided coordinates
         cropped_image = input_image.crop((x, y, x + width, y + height))
         
-        # Determine output format
-        if original_format.upper() in ["JPEG", "JPG"]:
-            output_format = "JPEG"
-            ext = "jpg"
-        elif original_format.upper() == "PNG":
-            output_format = "PNG"
-            ext = "png"
-        elif original_format.upper() == "WEBP":
-            output_format = "WEBP"
-            ext = "webp"
-        else:
+        # Determine output format (keep original, JPEG for anything else)
+        output_format = normalize_format(original_format, default="JPEG")
+        if output_format not in ["JPEG", "PNG", "WEBP"]:
             output_format = "JPEG"
-            ext = "jpg"
-        
-        # Convert RGBA to RGB for JPEG
-        if output_format == "JPEG" and cropped_image.mode in ["RGBA", "LA", "P"]:
-            rgb_image = Image.new("RGB", cropped_image.size, (255, 255, 255))
-            if cropped_image.mode == "P":
-                cropped_image = cropped_image.convert("RGBA")
-            rgb_image.paste(cropped_image, mask=cropped_image.split()[-1] if cropped_image.mode in ["RGBA", "LA"] else None)
-            cropped_image = rgb_image
-        
-        # Save CLEAN version
-        clean_buffer = io.BytesIO()
-        save_kwargs = {"optimize": True}
-        if output_format == "JPEG":
-            save_kwargs["quality"] = 95
-        
-        cropped_image.save(clean_buffer, format=output_format, **save_kwargs)
-        clean_bytes = clean_buffer.getvalue()
+        ext = format_extension(output_format)
         
         # Generate file ID
         file_id = str(uuid.uuid4())
-        original_name = Path(file.filename).stem
-        
-        # Save CLEAN cropped version (for download)
-        clean_filename = f"{file_id}_clean.{ext}"
-        clean_path = OUTPUT_DIR / clean_filename
-        with open(clean_path, "wb") as f:
-            f.write(clean_bytes)
+        original_name = Path(upload.filename).stem
         
-        # Create PREVIEW version (with watermark)
-        if cropped_image.mode != 'RGBA':
-            cropped_image = cropped_image.convert('RGBA')
+        # CLEAN cropped version (for download) and PREVIEW version
+        # (with watermark), encoded together
+        cropped_image.load()
         
-        watermarked_image = add_watermark(cropped_image, "PREVIEW")
+        def build_clean():
+            return encode_image(cropped_image, output_format)
         
-        # Convert back to RGB if needed for JPEG
-        if output_format == "JPEG" and watermarked_image.mode == "RGBA":
-            rgb_preview = Image.new("RGB", watermarked_image.size, (255, 255, 255))
-            rgb_preview.paste(watermarked_image, mask=watermarked_image.split()[-1])
-            watermarked_image = rgb_preview
+        def build_preview():
+            return render_preview(cropped_image, "PREVIEW")
         
-        preview_filename = f"{file_id}_preview.{ext}"
-        preview_path = OUTPUT_DIR / preview_filename
-        watermarked_image.save(preview_path, format=output_format, quality=85 if output_format == "JPEG" else None)
+        clean, preview = await build_artifacts(
+            OUTPUT_DIR, file_id, ext, build_clean, build_preview, preview_ext="webp"
+        )
         
         # NO credit deduction yet - only on download!
         
@@ -1532,7 +2329,7 @@ async def crop_image(
         return {
             "success": True,
             "file_id": file_id,
-            "preview_url": f"/outputs/{preview_filename}",
+            "preview_url": f"/outputs/{preview.filename}",
             "download_url": f"/api/download/{file_id}",
             "original_size": f"{original_width}x{original_height}",
             "cropped_size": f"{width}x{height}",
@@ -1550,44 +2347,78 @@ async def crop_image(
 # PDF TOOLS
 # ============================================================================
 
+# Inputs are read from their spool files, so single files can be large...
+PDF_MERGE_MAX_FILE_BYTES = int(os.getenv("PDF_MERGE_MAX_FILE_BYTES", 100 * 1024 * 1024))
+
+# ...but the pages being merged are held by the writer until it is saved
+PDF_MERGE_MEMORY_BUDGET = int(os.getenv("PDF_MERGE_MEMORY_BUDGET", 256 * 1024 * 1024))
+
+
 @app.post("/api/pdf/merge")
 async def merge_pdf_files(
-    files: List[UploadFile] = File(...),
+    request: Request,
+    files: List[UploadFile] = File(None),
+    upload_ids: str = Form(None),
+    page_ranges: str = Form(None),
     current_user: User = Depends(require_credits),
     db: Session = Depends(get_db)
 ):
     """
     Merge multiple PDF files (costs 1 credit)
+    
+    Args:
+        upload_ids: Comma-separated stored uploads, merged before any files
+        page_ranges: Pages to take from each input, separated by ";" in
+            input order, e.g. "1-3;all;2,5" (default: all pages of every input)
     """
-    if len(files) < 2:
+    pdf_uploads = await resolve_uploads(
+        files, upload_ids, current_user,
+        max_bytes=PDF_MERGE_MAX_FILE_BYTES,
+        error=f"PDF too large: {{filename}}. Max {PDF_MERGE_MAX_FILE_BYTES // (1024 * 1024)}MB per file"
+    )
+    
+    if len(pdf_uploads) < 2:
         raise HTTPException(status_code=400, detail="Need at least 2 PDFs to merge")
     
-    pdf_bytes_list = []
+    for upload in pdf_uploads:
+        require_pdf(upload, f"File {upload.filename} is not a PDF")
     
-    for file in files:
-        if file.content_type != "application/pdf":
-            raise HTTPException(status_code=400, detail=f"File {file.filename} is not a PDF")
-        
-        contents = await file.read()
-        
-        if len(contents) > 20 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="PDF too large. Max 20MB per file")
-        
-        pdf_bytes_list.append(contents)
+    range_specs = page_ranges.split(";") if page_ranges else ["all"] * len(pdf_uploads)
+    if len(range_specs) != len(pdf_uploads):
+        raise HTTPException(status_code=400, detail=f"page_ranges has {len(range_specs)} entries for {len(pdf_uploads)} PDFs")
+    
+    # Estimate the writer's working set from the share of each input being kept
+    selected_pages = []
+    working_set = 0
+    for upload, spec in zip(pdf_uploads, range_specs):
+        try:
+            total_pages = pdf_page_count(upload.stream())
+            pages = parse_page_numbers(spec or "all", total_pages)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{upload.filename}: {str(e)}")
+        except Exception:
+            raise HTTPException(status_code=400, detail=f"File {upload.filename} could not be read as a PDF")
+        
+        # Only the natural order means "whole file" - a reordered full selection keeps its order
+        selected_pages.append(None if pages == list(range(1, total_pages + 1)) else pages)
+        working_set += upload.size * len(pages) // max(total_pages, 1)
+    
+    if working_set > PDF_MERGE_MEMORY_BUDGET:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Selected pages too large to merge. Max {PDF_MERGE_MEMORY_BUDGET // (1024 * 1024)}MB combined"
+        )
     
     try:
         start_time = datetime.utcnow()
         
-        # Merge PDFs
-        merged_bytes = merge_pdfs(pdf_bytes_list)
-        
-        # Save file
         file_id = str(uuid.uuid4())
         output_filename = f"{file_id}_merged.pdf"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(merged_bytes)
+        # Merge PDFs straight into the output file
+        pages_merged = merge_pdfs_to_file([u.stream() for u in pdf_uploads], str(output_path), selected_pages)
+        output_size = os.path.getsize(output_path)
         
         # Deduct credit
         current_user.use_credit()
@@ -1596,35 +2427,49 @@ async def merge_pdf_files(
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=f"merge_{len(files)}_pdfs",
+            original_filename=f"merge_{len(pdf_uploads)}_pdfs",
             file_id=file_id,
             output_format="pdf",
-            original_size=sum(len(b) for b in pdf_bytes_list),
-            output_size=len(merged_bytes),
+            original_size=sum(u.size for u in pdf_uploads),
+            output_size=output_size,
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "files_merged": len(files),
-            "output_size": len(merged_bytes),
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "files_merged": len(pdf_uploads),
+                "pages_merged": pages_merged,
+                "output_size": output_size,
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            # Already on disk - inline, it is sent and then removed
+            output_path,
+            output_filename
+        )
         
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"PDF merge error: {str(e)}")
 
 
+# Splits with more parts than this come back as one ZIP instead of loose files
+PDF_SPLIT_LOOSE_FILES = int(os.getenv("PDF_SPLIT_LOOSE_FILES", 20))
+
+
 @app.post("/api/pdf/split")
 async def split_pdf_file(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     pages: str = Form("all"),
+    archive: str = Form("auto"),
     current_user: User = Depends(require_credits),
     db: Session = Depends(get_db)
 ):
@@ -1633,36 +2478,59 @@ async def split_pdf_file(
     
     Args:
         pages: "all" or "1-3,5,7-9" for specific pages/ranges
+        archive: "zip" for one archive, "files" for one download per part,
+            "auto" for files up to PDF_SPLIT_LOOSE_FILES parts and a ZIP beyond
     """
-    if file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="File must be a PDF")
+    if archive not in ("auto", "zip", "files"):
+        raise HTTPException(status_code=400, detail="Archive must be 'auto', 'zip' or 'files'")
+    
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="PDF too large. Max 20MB")
+    require_pdf(upload)
     
-    contents = await file.read()
+    # Parse once and check the spec before any part is built
+    try:
+        split = open_pdf_split(upload.path(), pages=pages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=400, detail="File could not be read as a PDF")
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="PDF too large. Max 20MB")
+    use_archive = archive == "zip" or (archive == "auto" and len(split.groups) > PDF_SPLIT_LOOSE_FILES)
     
     try:
         start_time = datetime.utcnow()
         
-        # Split PDF
-        split_pdfs = split_pdf(contents, pages=pages)
-        
         # Save files with original filename base
         file_id = str(uuid.uuid4())
         download_urls = []
+        output_sizes = []
         
         # Get original filename without extension
-        original_name = Path(file.filename).stem
+        original_name = Path(upload.filename).stem
+        zip_filename = f"{original_name}_pages_{file_id[:8]}.zip"
         
-        for idx, pdf_bytes in enumerate(split_pdfs, 1):
-            output_filename = f"{original_name}_page{idx}_{file_id[:8]}.pdf"
-            output_path = OUTPUT_DIR / output_filename
-            
-            with open(output_path, "wb") as f:
-                f.write(pdf_bytes)
-            
-            download_urls.append(f"/outputs/{output_filename}")
+        def page_files():
+            # Holds the upload open until the last part is written
+            try:
+                for idx, pdf_bytes in enumerate(split.parts, 1):
+                    output_sizes.append(len(pdf_bytes))
+                    yield f"{original_name}_page{idx}_{file_id[:8]}.pdf", pdf_bytes
+            finally:
+                upload.close()
+        
+        zip_chunks = None
+        if wants_inline(request):
+            # Parts are serialized while the ZIP streams out, so sizes aren't known yet
+            zip_chunks = iter_zip(page_files())
+        elif use_archive:
+            # Each part goes straight from the writer into the archive on disk
+            with open(OUTPUT_DIR / zip_filename, "wb") as f:
+                for chunk in iter_zip(page_files()):
+                    f.write(chunk)
+        else:
+            for output_filename, pdf_bytes in page_files():
+                write_output(request, OUTPUT_DIR / output_filename, pdf_bytes)
+                download_urls.append(f"/outputs/{output_filename}")
         
         # Deduct credit
         current_user.use_credit()
@@ -1671,24 +2539,30 @@ async def split_pdf_file(
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
-            output_format="pdf",
-            original_size=len(contents),
-            output_size=sum(len(p) for p in split_pdfs),
+            output_format="zip" if use_archive else "pdf",
+            original_size=upload.size,
+            output_size=sum(output_sizes) if output_sizes else None,
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
+        result = {
             "success": True,
             "file_id": file_id,
-            "download_urls": download_urls,
-            "pages_count": len(split_pdfs),
+            "pages_count": len(split.groups),
             "credits_remaining": current_user.credits_remaining,
             "timestamp": datetime.utcnow()
         }
+        if use_archive:
+            result["download_url"] = f"/outputs/{zip_filename}"
+        else:
+            result["download_urls"] = download_urls
+        
+        # Inline, the pages come back as one ZIP
+        return tool_response(request, result, zip_chunks, zip_filename)
         
     except Exception as e:
         db.rollback()
@@ -1697,130 +2571,139 @@ async def split_pdf_file(
 
 @app.post("/api/pdf/compress")
 async def compress_pdf_file(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    preset: str = Form("ebook"),
     current_user: User = Depends(require_credits),
     db: Session = Depends(get_db)
 ):
     """
     Compress a PDF file (costs 1 credit)
-    """
-    if file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="File must be a PDF")
     
-    contents = await file.read()
+    Args:
+        preset: screen (72 DPI images), ebook (150 DPI), print (300 DPI)
+            or lossless (no image recompression)
+    """
+    if preset not in PDF_COMPRESS_PRESETS:
+        raise HTTPException(status_code=400, detail=f"Invalid preset. Allowed: {', '.join(PDF_COMPRESS_PRESETS)}")
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="PDF too large. Max 20MB")
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="PDF too large. Max 20MB")
+    require_pdf(upload)
     
     try:
         start_time = datetime.utcnow()
         
         # Compress PDF
-        compressed_bytes = compress_pdf(contents)
+        compressed_bytes = compress_pdf(upload.stream(), preset=preset)
+        
+        # Already as small as it gets - don't hand back a bigger file
+        if len(compressed_bytes) >= upload.size:
+            compressed_bytes = upload.read_bytes()
         
         # Save file
         file_id = str(uuid.uuid4())
         output_filename = f"{file_id}_compressed.pdf"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(compressed_bytes)
+        write_output(request, output_path, compressed_bytes)
         
         # Deduct credit
         current_user.use_credit()
         
         # Record usage
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
-        compression_ratio = (1 - len(compressed_bytes) / len(contents)) * 100
+        compression_ratio = (1 - len(compressed_bytes) / upload.size) * 100
         
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format="pdf",
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=len(compressed_bytes),
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "original_size": len(contents),
-            "compressed_size": len(compressed_bytes),
-            "compression_ratio": f"{compression_ratio:.1f}%",
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "original_size": upload.size,
+                "compressed_size": len(compressed_bytes),
+                "compression_ratio": f"{compression_ratio:.1f}%",
+                "preset": preset,
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            compressed_bytes,
+            output_filename
+        )
         
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"PDF compression error: {str(e)}")
 
 
+# ============================================================================
+# JOBS
+# ============================================================================
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str, current_user: User = Depends(get_current_user)):
+    """Status, progress and (once done) result of a background conversion"""
+    try:
+        job = get_job(job_id, current_user.id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.to_dict()
+
+
 # ============================================================================
 # DOCUMENT CONVERSION (PDF ↔ Word/Excel)
 # ============================================================================
 
-@app.post("/api/convert/pdf-to-word")
-async def convert_pdf_to_word(
-    file: UploadFile = File(...),
-    current_user: User = Depends(require_credits),
-    db: Session = Depends(get_db)
-):
-    """
-    Convert PDF to Word document (costs 2 credits)
-    """
-    if file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="File must be a PDF")
+async def run_pdf_to_word(job: Job, upload: IngestedUpload, page_numbers: List[int], user_id: int) -> dict:
+    """Convert in an isolated worker, then charge 2 credits and record usage"""
+    start_time = datetime.utcnow()
     
-    contents = await file.read()
+    file_id = str(uuid.uuid4())
+    output_filename = f"{file_id}.docx"
+    output_path = OUTPUT_DIR / output_filename
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="PDF too large. Max 20MB")
+    try:
+        # pdf2docx needs a file path
+        pages_converted = await run_in_worker(job, pdf_to_docx, (upload.path(), str(output_path), page_numbers))
+    except JobTimeout as e:
+        raise HTTPException(status_code=504, detail=f"PDF to Word conversion error: {str(e)}")
+    except JobError as e:
+        raise HTTPException(status_code=500, detail=f"PDF to Word conversion error: {str(e)}")
+    finally:
+        upload.close()
     
+    # Background jobs outlive the request's session
+    db = SessionLocal()
     try:
-        from pdf2docx import Converter
-        import tempfile
-        
-        start_time = datetime.utcnow()
-        
-        # Create temp files
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_temp:
-            pdf_temp.write(contents)
-            pdf_path = pdf_temp.name
-        
-        file_id = str(uuid.uuid4())
-        output_filename = f"{file_id}.docx"
-        output_path = OUTPUT_DIR / output_filename
-        
-        # Convert PDF to Word
-        cv = Converter(pdf_path)
-        cv.convert(str(output_path))
-        cv.close()
-        
-        # Cleanup temp file
-        os.unlink(pdf_path)
-        
-        # Get output size
+        user = db.query(User).filter(User.id == user_id).first()
         output_size = os.path.getsize(output_path)
         
         # Deduct 2 credits
-        current_user.use_credit()
-        current_user.use_credit()
+        user.use_credit()
+        user.use_credit()
         
         # Record usage
         processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
         
         usage_record = UsageRecord(
-            user_id=current_user.id,
-            original_filename=file.filename,
+            user_id=user.id,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format="docx",
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=output_size,
             processing_time=processing_time
         )
@@ -1830,82 +2713,103 @@ async def convert_pdf_to_word(
         return {
             "success": True,
             "file_id": file_id,
+            "job_id": job.id,
             "download_url": f"/outputs/{output_filename}",
-            "original_size": len(contents),
+            "pages_converted": pages_converted,
+            "original_size": upload.size,
             "output_size": output_size,
-            "credits_remaining": current_user.credits_remaining,
+            "credits_remaining": user.credits_remaining,
             "timestamp": datetime.utcnow()
         }
         
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"PDF to Word conversion error: {str(e)}")
+    finally:
+        db.close()
+
+
+@app.post("/api/convert/pdf-to-word")
+async def convert_pdf_to_word(
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    pages: str = Form("all"),
+    background: bool = Form(False),
+    current_user: User = Depends(require_credits),
+    db: Session = Depends(get_db)
+):
+    """
+    Convert PDF to Word document (costs 2 credits)
+    
+    Conversion runs in an isolated worker process with a time and memory
+    limit, so a large document never blocks the server.
+    
+    Args:
+        pages: "all" or "1-3,5,7-9" for specific pages/ranges
+        background: Return a job_id at once (202) and poll /api/jobs/{job_id}
+            for progress and the result, instead of waiting for the document
+    """
+    if current_user.credits_balance < 2:
+        raise HTTPException(status_code=402, detail="Insufficient credits. PDF to Word costs 2 credits")
+    
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="PDF too large. Max 20MB")
+    require_pdf(upload)
+    
+    try:
+        page_numbers = parse_page_numbers(pages, pdf_page_count(upload.path()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=400, detail="File could not be read as a PDF")
+    
+    job = create_job(current_user.id, "pdf-to-word")
+    work = run_pdf_to_word(job, upload, page_numbers, current_user.id)
+    
+    if background:
+        # run_pdf_to_word closes the upload when the job is done
+        release_upload(upload)
+        start_background(job, work)
+        return JSONResponse(
+            status_code=202,
+            content={"success": True, "status_url": f"/api/jobs/{job.id}", **job.to_dict()}
+        )
+    
+    try:
+        result = await work
+    except HTTPException as e:
+        job.fail(e.detail)
+        raise
+    job.finish(result)
+    
+    # pdf2docx can only write to a path - inline, the file is removed once sent
+    return tool_response(request, result, OUTPUT_DIR / f"{result['file_id']}.docx", f"{result['file_id']}.docx")
 
 
 @app.post("/api/convert/pdf-to-excel")
 async def convert_pdf_to_excel(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     current_user: User = Depends(require_credits),
     db: Session = Depends(get_db)
 ):
     """
     Extract tables from PDF to Excel (costs 2 credits)
     """
-    if file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="File must be a PDF")
-    
-    contents = await file.read()
-    
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="PDF too large. Max 20MB")
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="PDF too large. Max 20MB")
+    require_pdf(upload)
     
     try:
-        from pypdf import PdfReader
-        from openpyxl import Workbook
-        import tempfile
-        
         start_time = datetime.utcnow()
         
-        # Create temp file
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_temp:
-            pdf_temp.write(contents)
-            pdf_path = pdf_temp.name
-        
-        # Extract text from PDF
-        reader = PdfReader(pdf_path)
-        
-        # Create Excel workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Extracted Text"
-        
-        # Extract text from each page
-        row = 1
-        for page_num, page in enumerate(reader.pages, 1):
-            text = page.extract_text()
-            ws.cell(row=row, column=1, value=f"Page {page_num}")
-            row += 1
-            
-            # Split text into lines and add to Excel
-            for line in text.split('\n'):
-                if line.strip():
-                    ws.cell(row=row, column=1, value=line.strip())
-                    row += 1
-            
-            row += 1  # Extra space between pages
-        
-        # Save Excel file
+        # Rows are streamed into a write-only workbook on disk page by page
         file_id = str(uuid.uuid4())
         output_filename = f"{file_id}.xlsx"
         output_path = OUTPUT_DIR / output_filename
         
-        wb.save(output_path)
-        
-        # Cleanup temp file
-        os.unlink(pdf_path)
-        
-        # Get output size
-        output_size = os.path.getsize(output_path)
+        pages_extracted = pdf_to_xlsx(upload.path(), str(output_path))
+        output_size = output_path.stat().st_size
         
         # Deduct 2 credits
         current_user.use_credit()
@@ -1916,26 +2820,31 @@ async def convert_pdf_to_excel(
         
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format="xlsx",
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=output_size,
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "original_size": len(contents),
-            "output_size": output_size,
-            "pages_extracted": len(reader.pages),
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "original_size": upload.size,
+                "output_size": output_size,
+                "pages_extracted": pages_extracted,
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            output_path,
+            output_filename
+        )
         
     except Exception as e:
         db.rollback()
@@ -1950,18 +2859,24 @@ async def convert_pdf_to_excel(
 
 @app.post("/api/convert/images-to-pdf")
 async def convert_images_to_pdf(
-    files: List[UploadFile] = File(...),
+    request: Request,
+    files: List[UploadFile] = File(None),
+    upload_ids: str = Form(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
     Convert one or more images to a single PDF.
     Cost: 1 credit
+    
+    Args:
+        upload_ids: Comma-separated stored uploads, placed before any files
     """
-    if not files or len(files) == 0:
+    upload_count = len(files or []) + len([i for i in (upload_ids or "").split(",") if i.strip()])
+    if upload_count == 0:
         raise HTTPException(status_code=400, detail="No files provided")
     
-    if len(files) > 50:
+    if upload_count > 50:
         raise HTTPException(status_code=400, detail="Maximum 50 images allowed")
     
     # Check credit
@@ -1972,32 +2887,29 @@ async def convert_images_to_pdf(
         start_time = datetime.utcnow()
         
         # Read all images
-        image_bytes_list = []
-        total_size = 0
+        image_uploads = await resolve_uploads(
+            files, upload_ids, current_user,
+            max_bytes=20 * 1024 * 1024, error="Image too large: {filename}. Max 20MB"
+        )
+        total_size = sum(upload.size for upload in image_uploads)
         
-        for file in files:
-            contents = await file.read()
-            total_size += len(contents)
-            
+        for upload in image_uploads:
             # Validate it's an image
-            try:
-                img = Image.open(io.BytesIO(contents))
-                img.verify()
-            except Exception:
-                raise HTTPException(status_code=400, detail=f"Invalid image file: {file.filename}")
-            
-            image_bytes_list.append(contents)
+            validate_image_upload(
+                upload.stream(),
+                allowed_formats=["JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF"],
+                error=f"Invalid image file: {upload.filename}"
+            )
         
         # Convert to PDF
-        pdf_bytes = images_to_pdf(image_bytes_list)
+        pdf_bytes = images_to_pdf([u.stream() for u in image_uploads])
         
         # Save output
         file_id = str(uuid.uuid4())
         output_filename = f"images_to_pdf_{file_id}.pdf"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(pdf_bytes)
+        write_output(request, output_path, pdf_bytes)
         
         # Deduct 1 credit
         current_user.use_credit()
@@ -2007,7 +2919,7 @@ async def convert_images_to_pdf(
         
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=f"{len(files)}_images",
+            original_filename=f"{len(image_uploads)}_images",
             file_id=file_id,
             output_format="pdf",
             original_size=total_size,
@@ -2017,16 +2929,21 @@ async def convert_images_to_pdf(
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "images_count": len(files),
-            "original_size": total_size,
-            "output_size": len(pdf_bytes),
-            "credits_remaining": current_user.credits_balance,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "images_count": len(image_uploads),
+                "original_size": total_size,
+                "output_size": len(pdf_bytes),
+                "credits_remaining": current_user.credits_balance,
+                "timestamp": datetime.utcnow()
+            },
+            pdf_bytes,
+            output_filename
+        )
         
     except HTTPException:
         raise
@@ -2041,9 +2958,12 @@ async def convert_images_to_pdf(
 
 @app.post("/api/convert/pdf-to-images")
 async def convert_pdf_to_images(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     output_format: str = Form("png"),
     dpi: int = Form(200),
+    pages: str = Form("all"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -2051,10 +2971,8 @@ async def convert_pdf_to_images(
     Convert PDF pages to images.
     Cost: 1 credit
     Formats: png, jpg
+    Pages: "all" or "1-3,5,7-9" - only these pages are rendered
     """
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files allowed")
-    
     if output_format.lower() not in ['png', 'jpg', 'jpeg']:
         raise HTTPException(status_code=400, detail="Output format must be 'png' or 'jpg'")
     
@@ -2068,25 +2986,27 @@ async def convert_pdf_to_images(
     try:
         start_time = datetime.utcnow()
         
-        # Read PDF
-        contents = await file.read()
+        # Read PDF (max 100MB) - spooled to disk, never fully buffered
+        upload = await resolve_upload(file, upload_id, current_user, max_bytes=100 * 1024 * 1024, error="PDF too large. Maximum 100MB allowed")
+        require_pdf(upload, "Only PDF files allowed")
         
-        # Check file size (max 100MB)
-        if len(contents) > 100 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="PDF too large. Maximum 100MB allowed")
+        try:
+            page_numbers = parse_page_numbers(pages, pdf_page_count(upload.path()))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Convert PDF to images
+        # Pages are rendered one at a time as the ZIP is written
         fmt = 'jpg' if output_format.lower() in ['jpg', 'jpeg'] else 'png'
-        image_bytes_list = pdf_to_images(contents, output_format=fmt, dpi=dpi)
+        rendered = iter_pdf_pages(upload.path(), output_format=fmt, dpi=dpi, page_numbers=page_numbers)
         
         # If single page, return single file
-        if len(image_bytes_list) == 1:
+        if len(page_numbers) == 1:
+            page_number, image_bytes = next(rendered)
             file_id = str(uuid.uuid4())
-            output_filename = f"pdf_page_1_{file_id}.{fmt}"
+            output_filename = f"pdf_page_{page_number}_{file_id}.{fmt}"
             output_path = OUTPUT_DIR / output_filename
             
-            with open(output_path, "wb") as f:
-                f.write(image_bytes_list[0])
+            write_output(request, output_path, image_bytes)
             
             # Deduct 1 credit
             current_user.use_credit()
@@ -2096,39 +3016,59 @@ async def convert_pdf_to_images(
             
             usage_record = UsageRecord(
                 user_id=current_user.id,
-                original_filename=file.filename,
+                original_filename=upload.filename,
                 file_id=file_id,
                 output_format=fmt,
-                original_size=len(contents),
-                output_size=len(image_bytes_list[0]),
+                original_size=upload.size,
+                output_size=len(image_bytes),
                 processing_time=processing_time
             )
             db.add(usage_record)
             db.commit()
             
-            return {
-                "success": True,
-                "file_id": file_id,
-                "download_url": f"/outputs/{output_filename}",
-                "pages_count": 1,
-                "original_size": len(contents),
-                "output_size": len(image_bytes_list[0]),
-                "credits_remaining": current_user.credits_balance,
-                "timestamp": datetime.utcnow()
-            }
+            return tool_response(
+                request,
+                {
+                    "success": True,
+                    "file_id": file_id,
+                    "download_url": f"/outputs/{output_filename}",
+                    "pages_count": 1,
+                    "original_size": upload.size,
+                    "output_size": len(image_bytes),
+                    "credits_remaining": current_user.credits_balance,
+                    "timestamp": datetime.utcnow()
+                },
+                image_bytes,
+                output_filename
+            )
         
         # Multiple pages - create ZIP
-        import zipfile
-        
         file_id = str(uuid.uuid4())
         zip_filename = f"pdf_to_images_{file_id}.zip"
         zip_path = OUTPUT_DIR / zip_filename
         
-        total_output_size = 0
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for i, img_bytes in enumerate(image_bytes_list, 1):
-                zipf.writestr(f"page_{i}.{fmt}", img_bytes)
-                total_output_size += len(img_bytes)
+        rendered_sizes = []
+        
+        def entries():
+            # Holds the upload (and its temp file) open until the last page is rendered
+            try:
+                for page_number, img_bytes in rendered:
+                    rendered_sizes.append(len(img_bytes))
+                    yield f"page_{page_number}.{fmt}", img_bytes
+            finally:
+                upload.close()
+        
+        # PNG/JPEG don't deflate, so iter_zip stores pages as-is
+        zip_chunks = iter_zip(entries())
+        
+        # Written page by page; inline responses render while streaming, so sizes aren't known yet
+        total_output_size = zip_size = None
+        if not wants_inline(request):
+            with open(zip_path, "wb") as f:
+                for chunk in zip_chunks:
+                    f.write(chunk)
+            total_output_size = sum(rendered_sizes)
+            zip_size = os.path.getsize(zip_path)
         
         # Deduct 1 credit
         current_user.use_credit()
@@ -2138,27 +3078,32 @@ async def convert_pdf_to_images(
         
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format="zip",
-            original_size=len(contents),
-            output_size=os.path.getsize(zip_path),
+            original_size=upload.size,
+            output_size=zip_size,
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{zip_filename}",
-            "pages_count": len(image_bytes_list),
-            "original_size": len(contents),
-            "output_size": total_output_size,
-            "zip_size": os.path.getsize(zip_path),
-            "credits_remaining": current_user.credits_balance,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{zip_filename}",
+                "pages_count": len(page_numbers),
+                "original_size": upload.size,
+                "output_size": total_output_size,
+                "zip_size": zip_size,
+                "credits_remaining": current_user.credits_balance,
+                "timestamp": datetime.utcnow()
+            },
+            zip_chunks,
+            zip_filename
+        )
         
     except HTTPException:
         raise
@@ -2175,21 +3120,27 @@ async def convert_pdf_to_images(
 
 @app.post("/api/blur/detect-faces")
 async def detect_faces_preview(
-    file: UploadFile = File(...),
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     current_user: User = Depends(get_current_user)
 ):
     """
     Detect faces in image for preview (no credit cost).
     Returns: face coordinates and preview image with highlighted boxes.
     """
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="Only image files allowed")
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
+    validate_image_upload(
+        upload.stream(),
+        allowed_formats=["JPEG", "PNG", "WEBP", "BMP", "TIFF"],
+        error="Only image files allowed"
+    )
     
     try:
-        contents = await file.read()
-        
-        # Detect faces
-        faces = detect_faces(contents)
+        # Detect faces (once per stored upload)
+        faces = upload.cache.get("faces")
+        if faces is None:
+            faces = detect_faces(upload.view())
+            upload.cache["faces"] = faces
         
         return {
             "success": True,
@@ -2204,7 +3155,9 @@ async def detect_faces_preview(
 
 @app.post("/api/blur/process")
 async def blur_sensitive_data(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
     mode: str = Form("auto"),
     blur_strength: str = Form("medium"),
     blur_regions: str = Form(None),  # JSON string of regions
@@ -2216,9 +3169,6 @@ async def blur_sensitive_data(
     Cost: 1 credit
     Modes: auto (face detection), manual (custom regions)
     """
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="Only image files allowed")
-    
     if mode not in ['auto', 'manual']:
         raise HTTPException(status_code=400, detail="Mode must be 'auto' or 'manual'")
     
@@ -2229,11 +3179,16 @@ async def blur_sensitive_data(
     if current_user.credits_balance < 1:
         raise HTTPException(status_code=402, detail="Insufficient credits")
     
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
+    validate_image_upload(
+        upload.stream(),
+        allowed_formats=["JPEG", "PNG", "WEBP", "BMP", "TIFF"],
+        error="Only image files allowed"
+    )
+    
     try:
         start_time = datetime.utcnow()
         
-        contents = await file.read()
-        
         # Parse blur regions for manual mode
         regions_list = None
         if mode == "manual" and blur_regions:
@@ -2247,7 +3202,7 @@ async def blur_sensitive_data(
         
         # Blur the image
         blurred_bytes = blur_image(
-            contents,
+            upload.view(),
             mode=mode,
             blur_regions=regions_list,
             blur_strength=blur_strength
@@ -2258,8 +3213,7 @@ async def blur_sensitive_data(
         output_filename = f"blurred_{file_id}.png"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "wb") as f:
-            f.write(blurred_bytes)
+        write_output(request, output_path, blurred_bytes)
         
         # Deduct 1 credit
         current_user.use_credit()
@@ -2269,27 +3223,32 @@ async def blur_sensitive_data(
         
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format="png",
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=len(blurred_bytes),
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "mode": mode,
-            "blur_strength": blur_strength,
-            "original_size": len(contents),
-            "output_size": len(blurred_bytes),
-            "credits_remaining": current_user.credits_balance,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "mode": mode,
+                "blur_strength": blur_strength,
+                "original_size": upload.size,
+                "output_size": len(blurred_bytes),
+                "credits_remaining": current_user.credits_balance,
+                "timestamp": datetime.utcnow()
+            },
+            blurred_bytes,
+            output_filename
+        )
         
     except HTTPException:
         raise
@@ -2302,74 +3261,139 @@ async def blur_sensitive_data(
 # OCR - TEXT EXTRACTION
 # ============================================================================
 
+def stream_pdf_ocr(upload: IngestedUpload, user_id: int) -> Iterator[bytes]:
+    """
+    NDJSON lines for /api/ocr/extract?stream: one per page, then a summary.
+    
+    The usage is charged once every page is done; a failure part-way is
+    reported as a final line with success false (the status is already sent).
+    """
+    start_time = datetime.utcnow()
+    extracted_text = ""
+    pages_ocr = 0
+    
+    def line(record: dict) -> bytes:
+        return (json.dumps(record, default=str) + "\n").encode("utf-8")
+    
+    try:
+        for page in iter_pdf_ocr(upload.path()):
+            extracted_text += f"--- Page {page.number} ---\n{page.text}\n\n"
+            pages_ocr += page.method == "ocr"
+            yield line({"page": page.number, "method": page.method, "text": page.text})
+    except Exception as e:
+        yield line({"success": False, "detail": f"OCR extraction error: {str(e)}"})
+        return
+    finally:
+        upload.close()
+    
+    # The request's session is gone by the time the body is streamed
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        
+        file_id = str(uuid.uuid4())
+        output_filename = f"{file_id}.txt"
+        with open(OUTPUT_DIR / output_filename, "w", encoding="utf-8") as f:
+            f.write(extracted_text)
+        
+        output_size = len(extracted_text.encode("utf-8"))
+        
+        # Deduct 2 credits
+        user.use_credit()
+        user.use_credit()
+        
+        # Record usage
+        processing_time = int((datetime.utcnow() - start_time).total_seconds() * 1000)
+        
+        usage_record = UsageRecord(
+            user_id=user.id,
+            original_filename=upload.filename,
+            file_id=file_id,
+            output_format="txt",
+            original_size=upload.size,
+            output_size=output_size,
+            processing_time=processing_time
+        )
+        db.add(usage_record)
+        db.commit()
+        
+        yield line({
+            "success": True,
+            "file_id": file_id,
+            "download_url": f"/outputs/{output_filename}",
+            "full_text_length": len(extracted_text),
+            "pages_ocr": pages_ocr,
+            "original_size": upload.size,
+            "output_size": output_size,
+            "credits_remaining": user.credits_remaining,
+            "timestamp": datetime.utcnow()
+        })
+        
+    except Exception as e:
+        db.rollback()
+        yield line({"success": False, "detail": f"OCR extraction error: {str(e)}"})
+    finally:
+        db.close()
+
+
 @app.post("/api/ocr/extract")
 async def extract_text_ocr(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    stream: bool = Form(False),
     current_user: User = Depends(require_credits),
     db: Session = Depends(get_db)
 ):
     """
     Extract text from image or PDF using OCR (costs 2 credits)
-    """
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp", "image/bmp", "image/tiff", "application/pdf"]
     
-    if file.content_type not in allowed_types:
-        raise HTTPException(status_code=400, detail="File must be an image or PDF")
-    
-    contents = await file.read()
+    Args:
+        stream: For PDFs, send newline-delimited JSON - one line per page
+            (in page order, as soon as it's done) and a final summary line
+    """
+    upload = await resolve_upload(file, upload_id, current_user, max_bytes=20 * 1024 * 1024, error="File too large. Max 20MB")
+    
+    # Detect the file type from its content, not the client's label
+    is_pdf = sniff_format(upload.head(SNIFF_BYTES)) == "PDF"
+    if not is_pdf:
+        validate_image_upload(
+            upload.stream(),
+            allowed_formats=["JPEG", "PNG", "WEBP", "BMP", "TIFF"],
+            error="File must be an image or PDF"
+        )
     
-    if len(contents) > 20 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="File too large. Max 20MB")
+    if is_pdf and stream:
+        return StreamingResponse(stream_pdf_ocr(upload, current_user.id), media_type="application/x-ndjson")
     
     try:
-        import pytesseract
-        from PIL import Image
-        from pypdf import PdfReader
-        from pdf2image import convert_from_bytes
-        import tempfile
-        
         start_time = datetime.utcnow()
         
-        extracted_text = ""
-        
-        if file.content_type == "application/pdf":
-            # Convert PDF pages to images and OCR each page
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_temp:
-                pdf_temp.write(contents)
-                pdf_path = pdf_temp.name
-            
-            # First try to extract text directly (if PDF has text layer)
-            reader = PdfReader(pdf_path)
-            has_text = False
-            
-            for page in reader.pages:
-                page_text = page.extract_text()
-                if page_text.strip():
-                    extracted_text += page_text + "\n\n"
-                    has_text = True
-            
-            # If no text found, use OCR on images
-            if not has_text:
-                images = convert_from_bytes(contents, dpi=300)
-                for i, image in enumerate(images, 1):
-                    page_text = pytesseract.image_to_string(image)
-                    extracted_text += f"--- Page {i} ---\n{page_text}\n\n"
-            
-            os.unlink(pdf_path)
+        page_methods = pages_ocr = None
+        
+        if is_pdf:
+            # Use each page's text layer where it has one; render and OCR
+            # only the pages that don't. Classification and the waits on
+            # Tesseract block, so the whole pass runs off the event loop
+            pages = await run_in_threadpool(list, iter_pdf_ocr(upload.path()))
+            extracted_text = "".join(f"--- Page {page.number} ---\n{page.text}\n\n" for page in pages)
+            page_methods = [
+                {"page": page.number, "method": page.method, "characters": len(page.text)}
+                for page in pages
+            ]
+            pages_ocr = sum(page.method == "ocr" for page in pages)
         else:
             # OCR on image
-            image = Image.open(BytesIO(contents))
-            extracted_text = pytesseract.image_to_string(image)
+            extracted_text = await run_in_threadpool(ocr_image, decode_upload(upload))
         
         # Save extracted text to file
         file_id = str(uuid.uuid4())
         output_filename = f"{file_id}.txt"
         output_path = OUTPUT_DIR / output_filename
         
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(extracted_text)
+        write_output(request, output_path, extracted_text)
         
-        output_size = os.path.getsize(output_path)
+        output_size = len(extracted_text.encode("utf-8"))
         
         # Deduct 2 credits
         current_user.use_credit()
@@ -2380,27 +3404,35 @@ async def extract_text_ocr(
         
         usage_record = UsageRecord(
             user_id=current_user.id,
-            original_filename=file.filename,
+            original_filename=upload.filename,
             file_id=file_id,
             output_format="txt",
-            original_size=len(contents),
+            original_size=upload.size,
             output_size=output_size,
             processing_time=processing_time
         )
         db.add(usage_record)
         db.commit()
         
-        return {
-            "success": True,
-            "file_id": file_id,
-            "download_url": f"/outputs/{output_filename}",
-            "extracted_text": extracted_text[:500] + ("..." if len(extracted_text) > 500 else ""),  # Preview
-            "full_text_length": len(extracted_text),
-            "original_size": len(contents),
-            "output_size": output_size,
-            "credits_remaining": current_user.credits_remaining,
-            "timestamp": datetime.utcnow()
-        }
+        return tool_response(
+            request,
+            {
+                "success": True,
+                "file_id": file_id,
+                "download_url": f"/outputs/{output_filename}",
+                "extracted_text": extracted_text[:500] + ("..." if len(extracted_text) > 500 else ""),  # Preview
+                "full_text_length": len(extracted_text),
+                "pages": page_methods,
+                "pages_ocr": pages_ocr,
+                "original_size": upload.size,
+                "output_size": output_size,
+                "credits_remaining": current_user.credits_remaining,
+                "timestamp": datetime.utcnow()
+            },
+            extracted_text,
+            output_filename,
+            media_type="text/plain; charset=utf-8"
+        )
         
     except Exception as e:
         db.rollback()
@@ -0,0 +1,123 @@
+"""
+Preview/clean artifacts - build the downloadable file and its watermarked
+preview side by side on a shared thread pool
+"""
+from PIL import Image
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, NamedTuple, Tuple
+
+from codec import encode_image
+from watermark import add_watermark
+
+
+# Threads shared by all requests for clean/preview encodes
+# (Pillow's encoders release the GIL, so these run truly in parallel)
+ARTIFACT_WORKERS = int(os.getenv("ARTIFACT_WORKERS", os.cpu_count() or 2))
+
+_pool = ThreadPoolExecutor(max_workers=ARTIFACT_WORKERS, thread_name_prefix="artifact")
+
+# Previews are shown at under 1000px in the UI - no point rendering more
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", 1024))
+
+# Preview encoding (WebP keeps transparency and is small at moderate quality)
+PREVIEW_FORMAT = "WEBP"
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", 70))
+
+
+class Artifact(NamedTuple):
+    """A file written to the outputs directory"""
+    filename: str
+    path: Path
+    size: int
+
+
+def render_preview(
+    image: Image.Image,
+    text: str = "PREVIEW",
+    fmt: str = PREVIEW_FORMAT,
+    quality: int = PREVIEW_QUALITY,
+    max_edge: int = PREVIEW_MAX_EDGE
+) -> bytes:
+    """
+    Downsample, watermark and encode a preview.
+
+    Scaling down first means the watermark is drawn and the preview encoded
+    at display size rather than full resolution. A JPEG that has not been
+    loaded yet is switched to draft mode and decoded at reduced size, so
+    don't reuse it afterwards.
+
+    Args:
+        image: Full-size PIL Image
+        text: Watermark text
+        fmt: Preview format (default WebP)
+        quality: 1-100 for lossy formats
+        max_edge: Longest edge of the preview in pixels
+
+    Returns:
+        Encoded preview bytes
+    """
+    width, height = image.size
+    scale = max_edge / max(width, height)
+
+    if scale < 1:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if image.format == "JPEG":
+            image.draft(image.mode, size)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    return encode_image(add_watermark(image, text), fmt, quality=quality, budget="preview")
+
+
+def _write_artifact(path: Path, build: Callable[[], bytes]) -> Artifact:
+    """Run an encode job and write its bytes to path"""
+    data = build()
+    with open(path, "wb") as f:
+        f.write(data)
+    return Artifact(path.name, path, len(data))
+
+
+async def build_artifacts(
+    output_dir: Path,
+    file_id: str,
+    ext: str,
+    clean: Callable[[], bytes],
+    preview: Callable[[], bytes],
+    preview_ext: str = None
+) -> Tuple[Artifact, Artifact]:
+    """
+    Encode and write the clean and preview files concurrently.
+
+    Both jobs run on the shared artifact pool, off the event loop. Any image
+    the two jobs share must already be loaded (call .load() first) so they
+    don't both trigger a lazy decode.
+
+    Args:
+        output_dir: Directory served under /outputs
+        file_id: ID used in both filenames
+        ext: Extension of the clean file
+        clean: Returns the clean (downloadable) file bytes
+        preview: Returns the watermarked preview bytes
+        preview_ext: Extension of the preview file (default: ext)
+
+    Returns:
+        (clean Artifact, preview Artifact)
+    """
+    loop = asyncio.get_running_loop()
+    clean_path = output_dir / f"{file_id}_clean.{ext}"
+    preview_path = output_dir / f"{file_id}_preview.{preview_ext or ext}"
+
+    clean_job = loop.run_in_executor(_pool, _write_artifact, clean_path, clean)
+    preview_job = loop.run_in_executor(_pool, _write_artifact, preview_path, preview)
+
+    try:
+        preview_artifact = await preview_job
+    finally:
+        # The download URL is only valid once the clean file is on disk
+        clean_artifact = await clean_job
+
+    return clean_artifact, preview_artifact
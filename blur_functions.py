@@ -4,11 +4,11 @@ Blur tool functions using MediaPipe for precise face detection
 import cv2
 import numpy as np
 import mediapipe as mp
-from typing import List, Tuple
+from typing import List, Tuple, Union
 
 
 def blur_image(
-    image_bytes: bytes,
+    image_bytes: Union[bytes, memoryview],
     mode: str = "auto",
     blur_regions: List[Tuple[int, int, int, int]] = None,
     blur_strength: str = "medium"
@@ -17,7 +17,7 @@ def blur_image(
     Blur sensitive information in images.
     
     Args:
-        image_bytes: Original image bytes
+        image_bytes: Original image bytes (or any buffer, e.g. a memoryview or mmap)
         mode: 'auto' for face detection, 'manual' for custom regions
         blur_regions: List of (x, y, width, height) tuples for manual mode
         blur_strength: 'low', 'medium', or 'high'
@@ -118,12 +118,12 @@ def blur_image(
     return buffer.tobytes()
 
 
-def detect_faces(image_bytes: bytes) -> List[Tuple[int, int, int, int]]:
+def detect_faces(image_bytes: Union[bytes, memoryview]) -> List[Tuple[int, int, int, int]]:
     """
     Detect faces in an image using MediaPipe Face Mesh (468 landmarks).
     
     Args:
-        image_bytes: Image file bytes
+        image_bytes: Image file bytes (or any buffer, e.g. a memoryview or mmap)
     
     Returns:
         List of (x, y, width, height) tuples for each detected face
@@ -0,0 +1,541 @@
+"""
+Image codec layer - decode, flatten and encode in one place
+Every image endpoint goes through these helpers so encoder tuning happens once
+"""
+from PIL import Image, features
+import numpy as np
+import io
+import logging
+import os
+import time
+from typing import Union, BinaryIO, Tuple, NamedTuple, Optional
+
+
+# Decoded-pixel budget - a 50 MP RGBA image is ~200 MB once decoded
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 50_000_000))
+
+# Keep Pillow's own bomb check in line with ours for any direct Image.open()
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image would decode to more pixels than the budget allows"""
+
+
+# ============================================================================
+# FORMATS
+# ============================================================================
+
+# User-facing format names -> Pillow format names
+FORMAT_ALIASES = {
+    "jpg": "JPEG",
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+    "bmp": "BMP",
+    "tif": "TIFF",
+    "tiff": "TIFF",
+    "avif": "AVIF",
+}
+
+# Pillow format names -> file extensions
+FORMAT_EXTENSIONS = {
+    "JPEG": "jpg",
+    "PNG": "png",
+    "WEBP": "webp",
+    "BMP": "bmp",
+    "TIFF": "tiff",
+    "AVIF": "avif",
+}
+
+# Formats that need an opaque RGB image
+OPAQUE_FORMATS = {"JPEG"}
+
+# Formats where a 1-100 quality value applies
+LOSSY_FORMATS = {"JPEG", "WEBP", "AVIF"}
+
+# AVIF needs Pillow built with libavif
+AVIF_AVAILABLE = features.check("avif")
+
+
+def normalize_format(fmt: str, default: str = "PNG") -> str:
+    """
+    Map a user-facing format name to a Pillow format name.
+
+    Args:
+        fmt: Format name or extension (jpg, jpeg, png, webp, ...)
+        default: Pillow format to use when fmt is unknown
+
+    Returns:
+        Pillow format name (JPEG, PNG, WEBP, BMP, TIFF, AVIF)
+    """
+    if not fmt:
+        return default
+    return FORMAT_ALIASES.get(fmt.lower().lstrip("."), default)
+
+
+def format_extension(fmt: str) -> str:
+    """Get the file extension for a Pillow or user-facing format name"""
+    return FORMAT_EXTENSIONS[normalize_format(fmt)]
+
+
+# ============================================================================
+# PROBE
+# ============================================================================
+
+# (offset, signature, format) - checked against the first bytes of a file
+MAGIC_SIGNATURES = [
+    (0, b"\xff\xd8\xff", "JPEG"),
+    (0, b"\x89PNG\r\n\x1a\n", "PNG"),
+    (0, b"GIF87a", "GIF"),
+    (0, b"GIF89a", "GIF"),
+    (0, b"BM", "BMP"),
+    (0, b"II*\x00", "TIFF"),
+    (0, b"MM\x00*", "TIFF"),
+    (0, b"%PDF-", "PDF"),
+    (4, b"ftypheic", "HEIF"),
+    (4, b"ftypheix", "HEIF"),
+    (4, b"ftypmif1", "HEIF"),
+    (4, b"ftypavif", "AVIF"),
+]
+
+# Bytes needed to cover every signature above
+SNIFF_BYTES = 16
+
+
+class ImageInfo(NamedTuple):
+    """Header-level description of an image, read without decoding pixels"""
+    format: str
+    width: int
+    height: int
+    mode: str
+    frames: int
+
+    @property
+    def pixels(self) -> int:
+        """Decoded pixel count across all frames"""
+        return self.width * self.height * self.frames
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """
+    Identify a file type from its magic bytes.
+
+    Args:
+        header: First bytes of the file (at least SNIFF_BYTES)
+
+    Returns:
+        Format name (JPEG, PNG, WEBP, GIF, BMP, TIFF, HEIF, AVIF, PDF) or None
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+
+    for offset, signature, fmt in MAGIC_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            return fmt
+
+    return None
+
+
+def _as_stream(source: Union[bytes, BinaryIO]) -> BinaryIO:
+    """Wrap bytes in a BytesIO, pass file objects through"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def check_pixel_budget(width: int, height: int, frames: int = 1, max_pixels: int = None):
+    """
+    Reject images that would decode to more pixels than allowed.
+
+    Args:
+        width: Image width
+        height: Image height
+        frames: Number of frames (animated images decode every frame)
+        max_pixels: Budget, defaults to MAX_IMAGE_PIXELS
+
+    Raises:
+        ImageTooLargeError: If the budget is exceeded
+    """
+    max_pixels = max_pixels or MAX_IMAGE_PIXELS
+    if width * height * frames > max_pixels:
+        raise ImageTooLargeError(
+            f"Image too large: {width}x{height}"
+            + (f" x {frames} frames" if frames > 1 else "")
+            + f" exceeds {max_pixels // 1_000_000} megapixels"
+        )
+
+
+def _open_header(stream: BinaryIO) -> Image.Image:
+    """
+    Open an image's header with the plugin that accepts it, like Image.open
+    but without Pillow's decompression-bomb check - so an oversized image
+    can still be described. Never load() the result.
+    """
+    Image.init()
+    start = stream.tell()
+    prefix = stream.read(16)
+
+    for format_id in Image.ID:
+        factory, accept = Image.OPEN[format_id]
+        stream.seek(start)
+        if accept and not accept(prefix):
+            continue
+        try:
+            return factory(stream, "")
+        except Exception:
+            continue
+
+    raise ValueError("Unrecognised image data")
+
+
+def probe_image(source: Union[bytes, BinaryIO], max_pixels: int = None) -> ImageInfo:
+    """
+    Read format, dimensions, mode and frame count from the image header.
+
+    No pixel data is decoded, so this is safe to call on untrusted uploads
+    before any real processing.
+
+    Args:
+        source: Image bytes or a seekable binary file object
+        max_pixels: Pixel budget to enforce, defaults to MAX_IMAGE_PIXELS
+
+    Returns:
+        ImageInfo
+
+    Raises:
+        ValueError: If the data is not a recognised image
+        ImageTooLargeError: If the image exceeds the pixel budget
+    """
+    stream = _as_stream(source)
+    start = stream.tell()
+    header = stream.read(SNIFF_BYTES)
+    stream.seek(start)
+
+    sniffed = sniff_format(header)
+    if sniffed is None or sniffed == "PDF":
+        raise ValueError("Unrecognised image data")
+
+    def describe(img: Image.Image) -> ImageInfo:
+        return ImageInfo(
+            format=img.format or sniffed,
+            width=img.width,
+            height=img.height,
+            mode=img.mode,
+            frames=getattr(img, "n_frames", 1),
+        )
+
+    try:
+        try:
+            with Image.open(stream) as img:
+                info = describe(img)
+        except Image.DecompressionBombError:
+            # Pillow refuses anything over 2x its limit before we see the
+            # size - read the header without that check and apply our budget
+            stream.seek(start)
+            with _open_header(stream) as img:
+                info = describe(img)
+    except Exception:
+        raise ValueError(f"Invalid or unsupported {sniffed} image")
+    finally:
+        stream.seek(start)
+
+    check_pixel_budget(info.width, info.height, info.frames, max_pixels)
+    return info
+
+
+# ============================================================================
+# DECODE
+# ============================================================================
+
+def decode_image(source: Union[bytes, BinaryIO], max_pixels: int = None) -> Image.Image:
+    """
+    Open an image from bytes or a file-like object.
+
+    Decoding is lazy: pixel data is only read when the image is first used,
+    so callers can still apply draft() or read the header cheaply. The pixel
+    budget is checked from the header before that happens.
+
+    Args:
+        source: Image bytes or a seekable binary file object
+        max_pixels: Pixel budget to enforce, defaults to MAX_IMAGE_PIXELS
+
+    Returns:
+        PIL Image (format attribute preserved)
+
+    Raises:
+        ImageTooLargeError: If the image exceeds the pixel budget
+    """
+    try:
+        img = Image.open(_as_stream(source))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+
+    check_pixel_budget(img.width, img.height, max_pixels=max_pixels)
+    return img
+
+
+# ============================================================================
+# FLATTEN
+# ============================================================================
+
+# Rows composited per step, keeps the uint16 scratch buffers small
+_FLATTEN_BLOCK_ROWS = 256
+
+
+def has_alpha(image: Image.Image) -> bool:
+    """
+    True if the image carries transparency - an alpha band, a transparency
+    key, or a palette whose entries have alpha
+    """
+    if image.mode in ("RGBA", "LA", "La", "PA", "RGBa") or "transparency" in image.info:
+        return True
+    return image.mode == "P" and image.palette is not None and image.palette.mode == "RGBA"
+
+
+def flatten_alpha(
+    image: Image.Image,
+    background: Tuple[int, int, int] = (255, 255, 255)
+) -> Image.Image:
+    """
+    Composite an image onto a solid background and return it as RGB.
+
+    Replaces the Image.new() + paste(mask=split()[3]) pattern: the alpha
+    blend is done with NumPy in row blocks straight into the output buffer,
+    so no per-band images or full-size temporaries are allocated.
+
+    Args:
+        image: PIL Image in any mode
+        background: RGB colour to put behind transparent pixels
+
+    Returns:
+        RGB PIL Image
+    """
+    if image.mode == "RGB":
+        return image
+
+    if not has_alpha(image):
+        return image.convert("RGB")
+
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+
+    if image.mode != "RGBA":
+        return image.convert("RGB")
+
+    pixels = np.asarray(image)
+    alpha = pixels[..., 3]
+
+    # Fully opaque - just drop the alpha band
+    if alpha.min() == 255:
+        return image.convert("RGB")
+
+    height = pixels.shape[0]
+    out = np.empty(pixels.shape[:2] + (3,), dtype=np.uint8)
+    bg = np.asarray(background, dtype=np.uint16)
+
+    for top in range(0, height, _FLATTEN_BLOCK_ROWS):
+        rows = slice(top, top + _FLATTEN_BLOCK_ROWS)
+        a = alpha[rows, :, None].astype(np.uint16)
+        blended = pixels[rows, :, :3].astype(np.uint16) * a
+        blended += bg * (255 - a)
+        blended += 127
+        blended //= 255
+        out[rows] = blended
+
+    return Image.fromarray(out, "RGB")
+
+
+# ============================================================================
+# ENCODE
+# ============================================================================
+
+# Base save() arguments per format - output quality, not encoder effort
+ENCODER_POLICY = {
+    "JPEG": {"quality": 95},
+    "PNG": {},
+    "WEBP": {"quality": 95},
+    "BMP": {},
+    "TIFF": {},
+    "AVIF": {"quality": 80},
+}
+
+# Encoder effort options per format, most effort first, each with its
+# estimated cost in ms per megapixel (measured on mixed photo/graphics).
+# The policy picks the first rung that fits the latency budget.
+EFFORT_LADDERS = {
+    "JPEG": [
+        ({"optimize": True, "progressive": True}, 25),
+        ({"optimize": True}, 12),
+        ({}, 5),
+    ],
+    "PNG": [
+        ({"optimize": True}, 210),
+        ({"compress_level": 6}, 165),
+        ({"compress_level": 3}, 135),
+        ({"compress_level": 1}, 125),
+    ],
+    "WEBP": [
+        ({"method": 6}, 430),
+        ({"method": 4}, 150),
+        ({"method": 2}, 70),
+        ({"method": 0}, 50),
+    ],
+    "AVIF": [
+        ({"speed": 4}, 900),
+        ({"speed": 6}, 400),
+        ({"speed": 8}, 150),
+    ],
+}
+
+# Encode latency budget per endpoint in ms (ENCODE_BUDGET_<NAME>_MS overrides)
+ENCODE_BUDGETS_MS = {
+    name: int(os.getenv(f"ENCODE_BUDGET_{name.upper()}_MS", default))
+    for name, default in {
+        "default": 1000,
+        "compress": 4000,
+        "preview": 250,
+    }.items()
+}
+
+logger = logging.getLogger("quicktools.encoder")
+
+
+def set_encode_budget(name: str, budget_ms: int):
+    """Change an endpoint's encode latency budget at runtime"""
+    if budget_ms <= 0:
+        raise ValueError("Budget must be positive")
+    ENCODE_BUDGETS_MS[name] = int(budget_ms)
+
+
+def effort_options(fmt: str, pixels: int, budget: Union[str, int] = "default") -> dict:
+    """
+    Pick encoder effort settings that fit a latency budget.
+    
+    Args:
+        fmt: Pillow format name
+        pixels: Image pixel count
+        budget: Endpoint name from ENCODE_BUDGETS_MS, or a budget in ms
+    
+    Returns:
+        Dict of save() arguments (empty for formats without a ladder)
+    """
+    ladder = EFFORT_LADDERS.get(fmt)
+    if not ladder:
+        return {}
+    
+    if isinstance(budget, str):
+        budget = ENCODE_BUDGETS_MS.get(budget, ENCODE_BUDGETS_MS["default"])
+    
+    megapixels = pixels / 1_000_000
+    for options, ms_per_megapixel in ladder:
+        if ms_per_megapixel * megapixels <= budget:
+            return dict(options)
+    
+    # Nothing fits - cheapest rung
+    return dict(ladder[-1][0])
+
+
+def prepare_for_format(image: Image.Image, fmt: str) -> Image.Image:
+    """
+    Convert an image to a mode the target encoder accepts.
+
+    Args:
+        image: PIL Image
+        fmt: Target format (user-facing or Pillow name)
+
+    Returns:
+        PIL Image ready to save in fmt
+    """
+    fmt = normalize_format(fmt)
+
+    if fmt in OPAQUE_FORMATS and image.mode not in ("RGB", "L", "CMYK"):
+        return flatten_alpha(image)
+
+    if fmt in ("WEBP", "AVIF") and image.mode not in ("RGB", "RGBA"):
+        return image.convert("RGBA" if has_alpha(image) else "RGB")
+
+    return image
+
+
+def encoder_options(
+    fmt: str,
+    quality: int = None,
+    pixels: int = 0,
+    budget: Union[str, int] = "default",
+    **overrides
+) -> dict:
+    """
+    Build save() arguments for a format from the encoder policy.
+
+    Args:
+        fmt: Target format (user-facing or Pillow name)
+        quality: 1-100, only used for lossy formats
+        pixels: Image pixel count, sizes the effort settings
+        budget: Endpoint name from ENCODE_BUDGETS_MS, or a budget in ms
+        **overrides: Extra or replacement save() arguments
+
+    Returns:
+        Dict of keyword arguments for Image.save()
+    """
+    fmt = normalize_format(fmt)
+    options = dict(ENCODER_POLICY.get(fmt, {}))
+    options.update(effort_options(fmt, pixels, budget))
+
+    if quality is not None and fmt in LOSSY_FORMATS:
+        options["quality"] = min(max(int(quality), 1), 100)
+
+    options.update(overrides)
+    return options
+
+
+def encode_image(
+    image: Image.Image,
+    fmt: str,
+    quality: int = None,
+    budget: Union[str, int] = "default",
+    **overrides
+) -> bytes:
+    """
+    Encode an image using the shared encoder policy.
+
+    Encoder effort (PNG compress level, WebP method, JPEG optimize and
+    progressive) is chosen from the image size and the latency budget.
+    Each encode is logged with its settings, size and time.
+
+    Args:
+        image: PIL Image
+        fmt: Target format (png, jpg, jpeg, webp, bmp, tiff, avif)
+        quality: 1-100, only used for lossy formats
+        budget: Endpoint name from ENCODE_BUDGETS_MS, or a budget in ms
+        **overrides: Extra or replacement save() arguments
+
+    Returns:
+        Encoded image bytes
+    """
+    fmt = normalize_format(fmt)
+    image = _encoder_view(prepare_for_format(image, fmt))
+    options = encoder_options(fmt, quality, image.width * image.height, budget, **overrides)
+
+    buf = io.BytesIO()
+    start = time.perf_counter()
+    image.save(buf, format=fmt, **options)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    logger.info(
+        "encode %s %dx%d budget=%s options=%s -> %d bytes in %.0f ms",
+        fmt, image.width, image.height, budget, options, buf.tell(), elapsed_ms
+    )
+    return buf.getvalue()
+
+
+def _encoder_view(image: Image.Image) -> Image.Image:
+    """
+    Get a separate Image object over the same pixel memory.
+
+    Image.save() stores the call's options on the image object itself
+    (encoderinfo), so threads encoding one image at the same time would
+    overwrite each other's settings. Each encode gets its own wrapper.
+    """
+    image.load()
+    return image._new(image.im)
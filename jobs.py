@@ -0,0 +1,260 @@
+"""
+Conversion jobs - run a heavy tool in an isolated worker process with a
+timeout and memory limit, and keep its status for /api/jobs/{job_id}
+"""
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+logger = logging.getLogger("quicktools.jobs")
+
+# Wall-clock limit and data-segment limit (heap + private anonymous
+# memory) for one worker process and each process it starts. Address
+# space isn't capped - PyMuPDF, OpenCV and thread arenas reserve far more
+# virtual memory than they use.
+JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", 300))
+JOB_MEMORY_MB = int(os.getenv("JOB_MEMORY_MB", 1024))
+
+# Worker processes allowed at once - the rest wait as "queued"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+
+# Finished jobs are kept this long (seconds) for status polling
+JOB_TTL = int(os.getenv("JOB_TTL", 3600))
+
+# Seconds between checks on a running worker
+JOB_POLL_INTERVAL = 0.25
+
+# spawn: the API process runs thread pools, which don't survive a fork
+_context = multiprocessing.get_context("spawn")
+_slots: Optional[asyncio.Semaphore] = None
+_jobs: Dict[str, "Job"] = {}
+_tasks = set()
+_running = set()
+
+
+class JobError(Exception):
+    """The worker failed, ran out of memory or was killed"""
+
+
+class JobTimeout(JobError):
+    """The worker ran longer than its timeout and was killed"""
+
+
+class Job:
+    """Status of one conversion, as reported by /api/jobs/{job_id}"""
+
+    def __init__(self, owner_id: int, kind: str):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.kind = kind
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def finish(self, result: dict):
+        self.status = "done"
+        self.progress = 1.0
+        self.result = result
+        self.finished_at = time.time()
+
+    def fail(self, error: str):
+        self.status = "failed"
+        self.error = error
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 3),
+            "message": self.message,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+def create_job(owner_id: int, kind: str) -> Job:
+    """Register a new queued job (and forget finished ones past JOB_TTL)"""
+    now = time.time()
+    for job_id in [j.id for j in _jobs.values() if j.finished_at and now - j.finished_at > JOB_TTL]:
+        del _jobs[job_id]
+
+    job = Job(owner_id, kind)
+    _jobs[job.id] = job
+    return job
+
+
+def get_job(job_id: str, owner_id: int) -> Job:
+    """Look up a job; raises KeyError if unknown or owned by someone else"""
+    job = _jobs.get(job_id)
+    if job is None or job.owner_id != owner_id:
+        raise KeyError(job_id)
+    return job
+
+
+def _worker_main(target: Callable, args: Tuple, memory_mb: int, messages):
+    """Child process: own process group, capped data segment, report back on a queue"""
+    os.setsid()
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+    def progress(fraction: float, message: str = ""):
+        messages.put(("progress", fraction, message))
+
+    try:
+        messages.put(("done", target(*args, progress=progress), ""))
+    except MemoryError:
+        messages.put(("error", f"Out of memory (limit {memory_mb}MB)", ""))
+    except Exception as e:
+        messages.put(("error", str(e) or type(e).__name__, ""))
+
+
+def _kill(process):
+    """Kill the worker and anything it started (await _join() to reap it)"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+@atexit.register
+def _kill_running():
+    """Workers aren't daemonic (they may start pools), so stop them on exit"""
+    for process in list(_running):
+        _kill(process)
+        process.join()
+
+
+async def _join(process):
+    """Wait for a worker that is exiting without blocking the event loop"""
+    while process.is_alive():
+        await asyncio.sleep(JOB_POLL_INTERVAL / 10)
+    process.join()
+
+
+async def _next_message(messages, process, deadline: float, timeout: int) -> Tuple[str, Any, str]:
+    """Wait for the worker's next message without blocking the event loop"""
+    while True:
+        try:
+            return messages.get_nowait()
+        except queue.Empty:
+            pass
+
+        if not process.is_alive():
+            # Its last message may still be in the pipe
+            for _ in range(10):
+                await asyncio.sleep(0.1)
+                try:
+                    return messages.get_nowait()
+                except queue.Empty:
+                    pass
+
+            # Exited without reporting - killed by the OOM killer or a signal
+            process.join()
+            raise JobError(f"Worker exited unexpectedly (code {process.exitcode})")
+
+        if time.monotonic() > deadline:
+            _kill(process)
+            await _join(process)
+            raise JobTimeout(f"Timed out after {timeout}s")
+
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+async def run_in_worker(
+    job: Job,
+    target: Callable[..., Any],
+    args: Tuple,
+    timeout: int = JOB_TIMEOUT,
+    memory_mb: int = JOB_MEMORY_MB
+) -> Any:
+    """
+    Run target(*args, progress=callback) in an isolated worker process.
+
+    Waits for a free worker slot, then polls the worker without blocking
+    the event loop, copying its progress into the job. The worker's whole
+    process group is killed on timeout, so helper processes it spawned go
+    with it.
+
+    Args:
+        job: Job to update (status, progress, message)
+        target: Module-level function (it is imported again in the child)
+        args: Positional arguments for target
+        timeout: Seconds before the worker is killed
+        memory_mb: Data-segment limit (MB) for the worker
+
+    Returns:
+        target's return value
+
+    Raises:
+        JobTimeout: If the worker ran too long
+        JobError: If the worker failed or died
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(JOB_WORKERS)
+
+    async with _slots:
+        job.status = "running"
+        messages = _context.Queue()
+        # Not daemonic - targets such as pdf2docx start process pools of their own
+        process = _context.Process(target=_worker_main, args=(target, args, memory_mb, messages))
+        process.start()
+        _running.add(process)
+        deadline = time.monotonic() + timeout
+        started = time.monotonic()
+
+        try:
+            while True:
+                kind, value, message = await _next_message(messages, process, deadline, timeout)
+
+                if kind == "progress":
+                    job.progress = max(job.progress, min(float(value), 0.99))
+                    job.message = message
+                elif kind == "done":
+                    await _join(process)
+                    logger.info("job %s %s done in %.1f s", job.kind, job.id, time.monotonic() - started)
+                    return value
+                else:
+                    await _join(process)
+                    raise JobError(value)
+        finally:
+            if process.is_alive():
+                _kill(process)
+                await _join(process)
+            _running.discard(process)
+            messages.close()
+
+
+def start_background(job: Job, work: Awaitable[dict]):
+    """
+    Run a job's coroutine after the response has been sent.
+
+    The coroutine returns the job's result; any exception marks the job failed.
+    """
+    async def runner():
+        try:
+            job.finish(await work)
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e)
+            logger.warning("job %s %s failed: %s", job.kind, job.id, detail)
+            job.fail(detail)
+
+    # Hold a reference so the task isn't garbage collected mid-run
+    task = asyncio.create_task(runner())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,88 @@
+"""
+Clean/preview artifact tests
+"""
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+import artifacts
+from artifacts import build_artifacts, render_preview
+
+
+@pytest.fixture(autouse=True)
+def two_workers(monkeypatch):
+    # The shared pool is sized by CPU count - the tests need both jobs running
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        monkeypatch.setattr(artifacts, "_pool", pool)
+        yield
+
+
+def test_both_files_are_written(tmp_path):
+    clean, preview = asyncio.run(
+        build_artifacts(tmp_path, "abc", "png", lambda: b"clean bytes", lambda: b"preview", preview_ext="webp")
+    )
+    
+    assert (clean.filename, clean.size) == ("abc_clean.png", 11)
+    assert (preview.filename, preview.size) == ("abc_preview.webp", 7)
+    assert clean.path.read_bytes() == b"clean bytes" and preview.path.read_bytes() == b"preview"
+
+
+def test_jobs_run_concurrently(tmp_path):
+    # Each job waits for the other to start - this deadlocks if they run in turn
+    barrier = threading.Barrier(2, timeout=5)
+    
+    def job():
+        barrier.wait()
+        return b"x"
+    
+    asyncio.run(build_artifacts(tmp_path, "abc", "jpg", job, job))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["abc_clean.jpg", "abc_preview.jpg"]
+
+
+def test_clean_file_finishes_when_the_preview_fails(tmp_path):
+    started = threading.Event()
+    
+    def clean():
+        started.wait(5)
+        return b"clean"
+    
+    def preview():
+        started.set()
+        raise RuntimeError("watermark failed")
+    
+    with pytest.raises(RuntimeError, match="watermark failed"):
+        asyncio.run(build_artifacts(tmp_path, "abc", "png", clean, preview))
+    assert (tmp_path / "abc_clean.png").read_bytes() == b"clean"
+
+
+def _jpeg(size) -> Image.Image:
+    buf = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(buf, "JPEG")
+    buf.seek(0)
+    return Image.open(buf)
+
+
+def test_preview_is_downscaled_webp():
+    preview = Image.open(io.BytesIO(render_preview(_jpeg((4000, 1000)), max_edge=800)))
+    assert preview.format == "WEBP"
+    assert preview.size == (800, 200)
+
+
+def test_jpeg_preview_uses_draft_decode():
+    image = _jpeg((4000, 2000))
+    render_preview(image, max_edge=500)
+    # Decoded straight at 1/8 scale instead of full size
+    assert image.size == (500, 250)
+
+
+def test_small_and_palette_images_keep_their_size():
+    image = Image.new("P", (300, 200))
+    preview = Image.open(io.BytesIO(render_preview(image, fmt="PNG")))
+    assert preview.size == (300, 200)
+    
+    palette = Image.new("P", (3000, 100))
+    assert Image.open(io.BytesIO(render_preview(palette, max_edge=600))).size == (600, 20)
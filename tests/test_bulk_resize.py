@@ -0,0 +1,52 @@
+"""
+Parallel bulk resize tests
+"""
+import io
+
+from PIL import Image
+
+from tools import bulk_resize_images, iter_bulk_resize_images
+
+
+def _png(width: int, height: int) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), (0, 120, 240)).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _size(data: bytes):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.size
+
+
+def test_bulk_resize_keeps_input_order():
+    images = [(f"img{i}.png", _png(100 + i * 50, 100)) for i in range(5)]
+    results = bulk_resize_images(images, width=50, format="JPEG", max_workers=3)
+    
+    assert [name for name, _ in results] == [f"img{i}_resized.jpg" for i in range(5)]
+    assert [_size(data)[1] for _, data in results] == [50, 33, 25, 20, 16]
+
+
+def test_failures_are_yielded_without_stopping_the_batch():
+    images = [("a.png", _png(80, 40)), ("broken.png", b"not an image"), ("c.png", io.BytesIO(_png(40, 80)))]
+    results = dict(iter_bulk_resize_images(images, width=20, max_workers=2))
+    
+    assert set(results) == {"a_resized.png", "broken.png", "c_resized.png"}
+    assert isinstance(results["broken.png"], Exception)
+    assert _size(results["a_resized.png"]) == (20, 10)
+    assert _size(results["c_resized.png"]) == (20, 40)
+
+
+def test_sources_are_pulled_lazily():
+    pulled = []
+    
+    def sources():
+        for i in range(20):
+            pulled.append(i)
+            yield f"{i}.png", _png(30, 30)
+    
+    results = iter_bulk_resize_images(sources(), width=10, max_workers=2)
+    next(results)
+    assert len(pulled) <= 2 * 2 + 1
+    
+    assert len(list(results)) == 19 and len(pulled) == 20
@@ -0,0 +1,159 @@
+"""
+Codec layer tests: format names, header probing, alpha flattening, encoding
+and encoder effort budgets
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import codec
+from codec import (
+    ImageTooLargeError, decode_image, effort_options, encode_image, encoder_options, flatten_alpha,
+    format_extension, normalize_format, prepare_for_format, probe_image, set_encode_budget, sniff_format
+)
+
+
+def _gradient_rgba(width=300, height=600) -> Image.Image:
+    """RGBA image whose alpha runs 0-255 across and spans several row blocks"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    pixels[..., 3] = np.linspace(0, 255, width, dtype=np.uint8)
+    return Image.fromarray(pixels, "RGBA")
+
+
+def test_format_names():
+    assert normalize_format("jpg") == normalize_format(".JPEG") == "JPEG"
+    assert normalize_format("heic") == "PNG"
+    assert normalize_format(None, default="WEBP") == "WEBP"
+    assert format_extension("tif") == "tiff"
+
+
+def _encoded(image: Image.Image, fmt: str, **options) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, **options)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF"])
+def test_sniff_format(fmt):
+    assert sniff_format(_encoded(Image.new("RGB", (4, 4)), fmt)[:16]) == fmt
+
+
+def test_sniff_unknown_and_pdf():
+    assert sniff_format(b"%PDF-1.7\n") == "PDF"
+    assert sniff_format(b"<html>") is None
+    assert sniff_format(b"RIFF\0\0\0\0WAVE") is None
+
+
+def test_probe_reads_header_only():
+    frames = [Image.new("RGB", (30, 20), (80 * i, 0, 0)) for i in range(3)]
+    stream = io.BytesIO(_encoded(frames[0], "GIF", save_all=True, append_images=frames[1:]))
+    
+    info = probe_image(stream)
+    assert (info.format, info.width, info.height, info.frames) == ("GIF", 30, 20, 3)
+    assert info.pixels == 1800
+    assert stream.tell() == 0
+
+
+def test_probe_counts_every_frame_against_the_budget():
+    frames = [Image.new("RGB", (30, 20), (80 * i, 0, 0)) for i in range(3)]
+    data = _encoded(frames[0], "GIF", save_all=True, append_images=frames[1:])
+    with pytest.raises(ImageTooLargeError, match="3 frames"):
+        probe_image(data, max_pixels=1000)
+
+
+def test_probe_rejects_non_images():
+    for data in (b"%PDF-1.7\n", b"not an image", b"\x89PNG\r\n\x1a\n" + bytes(20)):
+        with pytest.raises(ValueError):
+            probe_image(data)
+
+
+def test_probe_describes_pillow_bombs(monkeypatch):
+    # Over twice Pillow's limit, Image.open raises before the size is known
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    data = _encoded(Image.new("L", (100, 100)), "PNG")
+    
+    info = probe_image(data, max_pixels=20_000)
+    assert (info.format, info.width, info.height) == ("PNG", 100, 100)
+    with pytest.raises(ImageTooLargeError, match="100x100"):
+        probe_image(data, max_pixels=5000)
+
+
+def test_decode_enforces_the_budget():
+    data = _encoded(Image.new("RGB", (100, 100)), "PNG")
+    assert decode_image(data).size == (100, 100)
+    with pytest.raises(ImageTooLargeError):
+        decode_image(data, max_pixels=5000)
+
+
+@pytest.mark.parametrize("background", [(255, 255, 255), (10, 200, 30)])
+def test_flatten_matches_paste(background):
+    image = _gradient_rgba()
+    expected = Image.new("RGB", image.size, background)
+    expected.paste(image, mask=image.split()[3])
+    
+    difference = np.abs(
+        np.asarray(flatten_alpha(image, background), dtype=np.int16) - np.asarray(expected, dtype=np.int16)
+    )
+    assert difference.max() <= 1
+
+
+def test_flatten_palette_alpha():
+    image = Image.new("P", (4, 1))
+    image.putpalette([255, 0, 0, 0, 0, 255, 0, 255] + [0, 0, 0, 255] * 254, "RGBA")
+    image.putdata([0, 1, 0, 1])
+    
+    flat = flatten_alpha(image)
+    assert flat.mode == "RGB"
+    assert flat.getpixel((0, 0)) == (255, 255, 255) and flat.getpixel((1, 0)) == (0, 255, 0)
+
+
+def test_flatten_transparency_key_and_opaque_images():
+    image = Image.new("L", (2, 1), 0)
+    image.putpixel((1, 0), 128)
+    image.info["transparency"] = 0
+    assert flatten_alpha(image).getpixel((0, 0)) == (255, 255, 255)
+    
+    opaque = Image.new("RGBA", (2, 2), (1, 2, 3, 255))
+    assert flatten_alpha(opaque).getpixel((0, 0)) == (1, 2, 3)
+
+
+def test_prepare_for_format():
+    rgba = Image.new("RGBA", (2, 2), (0, 0, 0, 0))
+    assert prepare_for_format(rgba, "jpg").mode == "RGB"
+    assert prepare_for_format(rgba, "png") is rgba
+    assert prepare_for_format(Image.new("L", (2, 2)), "webp").mode == "RGB"
+    assert prepare_for_format(Image.new("LA", (2, 2)), "webp").mode == "RGBA"
+
+
+@pytest.mark.parametrize("fmt", ["jpg", "png", "webp", "bmp", "tiff"])
+def test_encode_round_trip(fmt):
+    data = encode_image(_gradient_rgba(64, 48), fmt, quality=80)
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.format == normalize_format(fmt)
+        assert decoded.size == (64, 48)
+
+
+def test_effort_follows_the_budget():
+    # 1 MP: WebP method 6 costs ~430 ms, method 4 ~150 ms
+    assert effort_options("WEBP", 1_000_000, 1000) == {"method": 6}
+    assert effort_options("WEBP", 1_000_000, 200) == {"method": 4}
+    assert effort_options("WEBP", 1_000_000, 1) == {"method": 0}
+    assert effort_options("BMP", 1_000_000, 1) == {}
+
+
+def test_named_budgets(monkeypatch):
+    monkeypatch.setattr(codec, "ENCODE_BUDGETS_MS", dict(codec.ENCODE_BUDGETS_MS))
+    set_encode_budget("thumbs", 60)
+    assert effort_options("JPEG", 4_000_000, "thumbs") == {"optimize": True}
+    assert effort_options("JPEG", 4_000_000, "unknown") == effort_options("JPEG", 4_000_000)
+    with pytest.raises(ValueError):
+        set_encode_budget("thumbs", 0)
+
+
+def test_encoder_options_clamp_quality_and_keep_overrides():
+    options = encoder_options("jpg", quality=400, pixels=100, budget=1000, progressive=False)
+    assert options == {"quality": 100, "optimize": True, "progressive": False}
+    assert "quality" not in encoder_options("png", quality=50)
@@ -0,0 +1,70 @@
+"""
+compress_pdf regression tests
+"""
+import io
+import zlib
+
+import numpy as np
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+)
+
+from tools import compress_pdf
+
+
+def _image_xobject(writer: PdfWriter, seed: int):
+    """A noisy 400x400 RGB image stored as Flate, so JPEG will beat it"""
+    pixels = np.random.default_rng(seed).integers(0, 256, (400, 400, 3), dtype=np.uint8)
+    image = StreamObject()
+    image._data = zlib.compress(pixels.tobytes())
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(400),
+        NameObject("/Height"): NumberObject(400),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode"),
+    })
+    return writer._add_object(image)
+
+
+def _shared_resources_pdf() -> bytes:
+    """Two pages sharing one indirect /Resources, each drawing a different image"""
+    writer = PdfWriter()
+    resources = writer._add_object(DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({
+            NameObject("/Im0"): _image_xobject(writer, 0),
+            NameObject("/Im1"): _image_xobject(writer, 1),
+            NameObject("/Unused"): _image_xobject(writer, 2),
+        })
+    }))
+    
+    for name in ("/Im0", "/Im1"):
+        page = writer.add_blank_page(612, 792)
+        content = DecodedStreamObject()
+        content.set_data(f"q 400 0 0 400 100 200 cm {name} Do Q".encode())
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/Resources")] = resources
+    
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def test_shared_resources_keep_every_drawn_image():
+    reader = PdfReader(io.BytesIO(compress_pdf(_shared_resources_pdf(), "ebook")))
+    
+    for page, name in zip(reader.pages, ("/Im0", "/Im1")):
+        xobjects = page["/Resources"]["/XObject"]
+        assert name in xobjects
+        assert xobjects[name].get_object()["/Filter"] == "/DCTDecode"
+        assert xobjects[name].get_object().decode_as_image().size == (400, 400)
+
+
+def test_image_drawn_by_no_page_is_dropped():
+    reader = PdfReader(io.BytesIO(compress_pdf(_shared_resources_pdf(), "ebook")))
+    
+    for page in reader.pages:
+        assert "/Unused" not in page["/Resources"]["/XObject"]
@@ -0,0 +1,86 @@
+"""
+Isolated worker job tests (targets must be module-level - the worker is spawned)
+"""
+import asyncio
+import os
+import time
+
+import pytest
+
+import jobs
+
+
+def double(n, progress=None):
+    progress(0.5, "halfway")
+    return n * 2
+
+
+def sleep_forever(progress=None):
+    time.sleep(60)
+
+
+def fail(progress=None):
+    raise RuntimeError("bad pdf")
+
+
+def exit_silently(progress=None):
+    os._exit(3)
+
+
+def grab_memory(progress=None):
+    return len(bytearray(256 * 1024 * 1024))
+
+
+def _square(x):
+    return x * x
+
+
+def use_pool(progress=None):
+    import multiprocessing
+    with multiprocessing.Pool(2) as pool:
+        return sum(pool.map(_square, range(5)))
+
+
+def _run(target, *args, **kwargs):
+    job = jobs.create_job(1, "test")
+    return job, asyncio.run(jobs.run_in_worker(job, target, args, **kwargs))
+
+
+def test_result_and_progress():
+    job, result = _run(double, 21)
+    assert result == 42
+    assert job.status == "running" and job.message == "halfway"
+
+
+def test_timeout_kills_worker():
+    started = time.monotonic()
+    with pytest.raises(jobs.JobTimeout):
+        _run(sleep_forever, timeout=1)
+    assert time.monotonic() - started < 10
+    assert not jobs._running
+
+
+def test_exception_is_reported():
+    with pytest.raises(jobs.JobError, match="bad pdf"):
+        _run(fail)
+
+
+def test_silent_exit_is_reported():
+    with pytest.raises(jobs.JobError, match="exited unexpectedly"):
+        _run(exit_silently)
+
+
+def test_memory_limit():
+    with pytest.raises(jobs.JobError, match="Out of memory"):
+        _run(grab_memory, memory_mb=128)
+
+
+def test_worker_may_start_a_pool():
+    assert _run(use_pool)[1] == 30
+
+
+def test_jobs_are_private_to_their_owner():
+    job = jobs.create_job(1, "test")
+    assert jobs.get_job(job.id, 1) is job
+    with pytest.raises(KeyError):
+        jobs.get_job(job.id, 2)
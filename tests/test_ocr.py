@@ -0,0 +1,134 @@
+"""
+Hybrid OCR tests: page classification and the ordered OCR pool
+"""
+import io
+import json
+import time
+import zlib
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    DecodedStreamObject, DictionaryObject, NameObject, NumberObject, StreamObject
+)
+
+import tools
+from tools import classify_pdf_page
+
+HEADER = "BT /F1 12 Tf 72 740 Td (Scanned by the records office) Tj ET"
+BODY = " ".join(
+    f"BT /F1 10 Tf 72 {740 - 14 * i} Td (Line {i} of a page with a real text layer and plenty of words) Tj ET"
+    for i in range(48)
+)
+
+
+def _page_pdf(content: str) -> bytes:
+    """One letter-size page with a Helvetica font and a 100x100 gray image as /Im0"""
+    writer = PdfWriter()
+    image = StreamObject()
+    image._data = zlib.compress(bytes(100 * 100))
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(100),
+        NameObject("/Height"): NumberObject(100),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode"),
+    })
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    
+    page = writer.add_blank_page(612, 792)
+    stream = DecodedStreamObject()
+    stream.set_data(content.encode())
+    page[NameObject("/Contents")] = writer._add_object(stream)
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer._add_object(image)}),
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)}),
+    })
+    
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def _classify(content: str):
+    return classify_pdf_page(PdfReader(io.BytesIO(_page_pdf(content))).pages[0])
+
+
+def test_text_layer_is_used():
+    method, text = _classify(BODY)
+    assert method == "text" and "Line 47" in text
+
+
+def test_empty_page_needs_ocr():
+    assert _classify("q 612 0 0 792 0 0 cm /Im0 Do Q")[0] == "ocr"
+
+
+def test_scan_with_typed_header_needs_ocr():
+    method, text = _classify(f"q 612 0 0 792 0 0 cm /Im0 Do Q {HEADER}")
+    assert method == "ocr" and "records office" in text
+
+
+def test_sparse_text_with_small_image_keeps_text_layer():
+    # A logo scaled up inside a saved graphics state mustn't leak its scale
+    assert _classify(f"q 2 0 0 2 0 0 cm q 50 0 0 50 0 0 cm /Im0 Do Q Q {HEADER}")[0] == "text"
+
+
+def test_nested_scale_is_tracked():
+    assert _classify(f"q 2 0 0 2 0 0 cm q 306 0 0 396 0 0 cm /Im0 Do Q Q {HEADER}")[0] == "ocr"
+
+
+def test_pages_come_back_in_order(tmp_path, monkeypatch):
+    # Scans and text pages interleaved; later scans finish first
+    contents = ["q 612 0 0 792 0 0 cm /Im0 Do Q", BODY] * 4
+    writer = PdfWriter()
+    for content in contents:
+        writer.add_page(PdfReader(io.BytesIO(_page_pdf(content))).pages[0])
+    pdf_path = tmp_path / "mixed.pdf"
+    writer.write(str(pdf_path))
+    
+    ocred = []
+    
+    def fake_ocr(path, number, dpi):
+        time.sleep(0.05 * (len(contents) - number))
+        ocred.append(number)
+        return f"ocr text {number}"
+    
+    monkeypatch.setattr(tools, "_ocr_pdf_page", fake_ocr)
+    pages = list(tools.iter_pdf_ocr(str(pdf_path), max_workers=2))
+    
+    assert [page.number for page in pages] == list(range(1, 9))
+    assert [page.method for page in pages] == ["ocr", "text"] * 4
+    assert pages[2].text == "ocr text 3" and "Line 0" in pages[3].text
+    assert sorted(ocred) == [1, 3, 5, 7]
+
+
+def test_stream_reports_a_failure_after_sent_pages(monkeypatch):
+    # Needs the full app stack (database, rembg, ...)
+    app = pytest.importorskip("app")
+    
+    class Upload:
+        closed = False
+        
+        def path(self):
+            return "scan.pdf"
+        
+        def close(self):
+            self.closed = True
+    
+    def broken_ocr(path):
+        yield tools.OcrPage(1, "text", "first page")
+        raise RuntimeError("tesseract crashed")
+    
+    monkeypatch.setattr(app, "iter_pdf_ocr", broken_ocr)
+    upload = Upload()
+    lines = [json.loads(line) for line in app.stream_pdf_ocr(upload, user_id=1)]
+    
+    assert lines[0] == {"page": 1, "method": "text", "text": "first page"}
+    assert lines[1]["success"] is False and "tesseract crashed" in lines[1]["detail"]
+    assert len(lines) == 2 and upload.closed
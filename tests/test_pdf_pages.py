@@ -0,0 +1,73 @@
+"""
+PDF page rendering and page-spec parsing tests
+"""
+import io
+import shutil
+
+import pytest
+from PIL import Image
+from pypdf import PdfWriter
+
+from tools import iter_pdf_pages, parse_page_groups, parse_page_numbers
+
+
+def _sized_pages_pdf(count: int) -> bytes:
+    """Blank pages whose width identifies them: page n is 100 + 20n points wide"""
+    writer = PdfWriter()
+    for n in range(1, count + 1):
+        writer.add_blank_page(100 + 20 * n, 200)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+@pytest.mark.skipif(shutil.which("pdftoppm") is None, reason="needs poppler")
+@pytest.mark.parametrize("native", [True, False])
+def test_threaded_render_keeps_every_page_on_its_number(native):
+    pytest.importorskip("pdf2image")
+    pdf = _sized_pages_pdf(11)
+    
+    rendered = list(iter_pdf_pages(pdf, "png", dpi=72, thread_count=3, native=native))
+    
+    assert [n for n, _ in rendered] == list(range(1, 12))
+    for n, data in rendered:
+        with Image.open(io.BytesIO(data)) as img:
+            assert img.width == 100 + 20 * n
+
+
+@pytest.mark.skipif(shutil.which("pdftoppm") is None, reason="needs poppler")
+def test_rejected_native_options_fall_back_to_pil(monkeypatch):
+    pdf2image = pytest.importorskip("pdf2image")
+    convert_from_path = pdf2image.convert_from_path
+    formats = []
+    
+    def old_poppler(*args, **kwargs):
+        formats.append(kwargs.get("fmt"))
+        if "jpegopt" in kwargs:
+            raise RuntimeError("pdftoppm: unknown option -jpegopt")
+        return convert_from_path(*args, **kwargs)
+    
+    monkeypatch.setattr(pdf2image, "convert_from_path", old_poppler)
+    rendered = list(iter_pdf_pages(_sized_pages_pdf(4), "jpg", dpi=72, thread_count=2))
+    
+    # Native JPEG is tried once, then every run goes through PPM
+    assert formats == ["jpeg", "ppm", "ppm"]
+    assert [n for n, _ in rendered] == [1, 2, 3, 4]
+    for _, data in rendered:
+        assert data.startswith(b"\xff\xd8\xff")
+
+
+def test_page_groups_keep_ranges_together():
+    assert parse_page_groups("1-3,5,7-8", 10) == [[1, 2, 3], [5], [7, 8]]
+    assert parse_page_groups("all", 3) == [[1], [2], [3]]
+
+
+def test_page_numbers_keep_order_and_drop_duplicates():
+    assert parse_page_numbers("3,1-2,2", 5) == [3, 1, 2]
+    assert parse_page_numbers("all", 4) == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("spec", ["0", "4", "2-5", "a-b", "3-1", ""])
+def test_bad_page_specs_are_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_page_numbers(spec, 3)
@@ -0,0 +1,39 @@
+"""
+quantize_png / SSIM alpha handling tests
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+from codec import flatten_alpha, has_alpha
+from tools import quantize_png
+
+
+def _few_colors(bands: int) -> Image.Image:
+    """64x80 image using 200 random colours"""
+    rng = np.random.default_rng(0)
+    palette = rng.integers(0, 256, (200, bands), dtype=np.uint8)
+    return Image.fromarray(palette[rng.integers(0, 200, (64, 80))])
+
+
+def test_exact_palette_is_lossless():
+    for bands, mode in ((3, "RGB"), (4, "RGBA")):
+        img = _few_colors(bands)
+        result = quantize_png(img)
+        decoded = Image.open(io.BytesIO(result.data)).convert(mode)
+        
+        assert result.colors == 200
+        assert result.ssim == 1.0
+        assert np.array_equal(np.asarray(decoded), np.asarray(img))
+
+
+def test_palette_alpha_is_flattened():
+    paletted = _few_colors(4).quantize(64, method=Image.Quantize.FASTOCTREE)
+    assert "transparency" not in paletted.info
+    
+    assert has_alpha(paletted)
+    assert np.array_equal(
+        np.asarray(flatten_alpha(paletted)),
+        np.asarray(flatten_alpha(paletted.convert("RGBA")))
+    )
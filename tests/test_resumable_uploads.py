@@ -0,0 +1,105 @@
+"""
+Resumable (chunked) upload tests
+"""
+import asyncio
+import hashlib
+
+import pytest
+
+import uploads
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_STORE_DIR", tmp_path)
+    monkeypatch.setattr(uploads, "RESUMABLE_DIR", tmp_path / "partial")
+    monkeypatch.setattr(uploads, "_hashers", {})
+    monkeypatch.setattr(uploads, "_locks", {})
+    return tmp_path
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def _append(upload_id, offset, *parts, owner_id=1):
+    return asyncio.run(uploads.append_resumable(upload_id, owner_id, offset, _chunks(*parts)))
+
+
+def test_chunks_complete_and_finalize(store):
+    upload_id = uploads.create_resumable(1, "scan.PDF", len(DATA))["upload_id"]
+    assert _append(upload_id, 0, DATA[:1000], DATA[1000:4000])["offset"] == 4000
+    assert _append(upload_id, 4000, DATA[4000:])["offset"] == len(DATA)
+    
+    upload = uploads.complete_resumable(upload_id, 1)
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+    
+    record = uploads.finalize_resumable(upload, upload_id, 1, {"format": "PDF"})
+    assert record["upload_id"] == upload_id and record["format"] == "PDF"
+    assert record["stored_as"] == f"{upload_id}.pdf"
+    assert not list((store / "partial").iterdir())
+    
+    with uploads.open_stored_upload(upload_id, 1) as stored:
+        assert stored.read_bytes() == DATA
+
+
+def test_offset_mismatch_keeps_state():
+    upload_id = uploads.create_resumable(1, "a.bin", len(DATA))["upload_id"]
+    _append(upload_id, 0, DATA[:100])
+    
+    with pytest.raises(uploads.OffsetMismatchError, match="offset 100"):
+        _append(upload_id, 50, DATA[50:200])
+    assert uploads.get_resumable(upload_id, 1)["offset"] == 100
+
+
+def test_data_past_declared_length_is_rejected():
+    upload_id = uploads.create_resumable(1, "a.bin", 10)["upload_id"]
+    with pytest.raises(ValueError, match="past the declared"):
+        _append(upload_id, 0, b"12345", b"678901")
+    assert uploads.get_resumable(upload_id, 1)["offset"] == 5
+
+
+def test_dropped_connection_keeps_received_bytes():
+    upload_id = uploads.create_resumable(1, "a.bin", len(DATA))["upload_id"]
+    
+    async def dropped():
+        yield DATA[:300]
+        raise ConnectionResetError
+    
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(uploads.append_resumable(upload_id, 1, 0, dropped()))
+    assert uploads.get_resumable(upload_id, 1)["offset"] == 300
+    
+    _append(upload_id, 300, DATA[300:])
+    assert uploads.complete_resumable(upload_id, 1).sha256 == hashlib.sha256(DATA).hexdigest()
+
+
+def test_hash_is_rebuilt_after_a_restart():
+    upload_id = uploads.create_resumable(1, "a.bin", len(DATA))["upload_id"]
+    _append(upload_id, 0, DATA[:2500])
+    uploads._hashers.clear()
+    _append(upload_id, 2500, DATA[2500:])
+    
+    assert uploads.complete_resumable(upload_id, 1).sha256 == hashlib.sha256(DATA).hexdigest()
+
+
+def test_incomplete_upload_cannot_be_completed():
+    upload_id = uploads.create_resumable(1, "a.bin", len(DATA))["upload_id"]
+    _append(upload_id, 0, DATA[:10])
+    with pytest.raises(ValueError, match="10 of"):
+        uploads.complete_resumable(upload_id, 1)
+
+
+def test_foreign_and_expired_uploads_are_hidden(monkeypatch):
+    upload_id = uploads.create_resumable(1, "a.bin", 10)["upload_id"]
+    with pytest.raises(KeyError):
+        _append(upload_id, 0, b"x", owner_id=2)
+    
+    monkeypatch.setattr(uploads, "RESUMABLE_TTL", -1)
+    expired = uploads.create_resumable(1, "a.bin", 10)["upload_id"]
+    with pytest.raises(KeyError):
+        uploads.get_resumable(expired, 1)
+    assert not (uploads.RESUMABLE_DIR / f"{expired}.part").exists()
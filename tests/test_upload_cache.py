@@ -0,0 +1,56 @@
+"""
+Stored-upload derived-data cache tests
+"""
+import io
+
+import pytest
+
+import uploads
+
+
+@pytest.fixture(autouse=True)
+def small_cache(monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CACHE_MAX_BYTES", 32_000)
+    monkeypatch.setattr(uploads, "_derived", uploads.OrderedDict())
+    monkeypatch.setattr(uploads, "_derived_sizes", {})
+
+
+def _stored(n: int) -> uploads.IngestedUpload:
+    upload = uploads.IngestedUpload("x.png", io.BytesIO(b""), 0, "")
+    upload.upload_id = f"{n:032x}"
+    upload.cache = uploads.derived_cache(upload.upload_id)
+    return upload
+
+
+def test_replacing_a_key_does_not_double_count():
+    upload = _stored(1)
+    for _ in range(10):
+        assert uploads.cache_large(upload, "image", object(), 7_500)
+    
+    assert uploads._cached_bytes(upload.upload_id) == 7_500
+    assert list(uploads._derived) == [upload.upload_id]
+
+
+def test_least_recently_used_dropped_over_budget():
+    first, second = _stored(1), _stored(2)
+    uploads.cache_large(first, "image", object(), 7_500)
+    uploads.cache_large(second, "image", object(), 7_500)
+    
+    uploads.derived_cache(first.upload_id)  # touch - second is now oldest
+    third = _stored(3)
+    uploads.cache_large(third, "image", object(), 7_500)
+    uploads.cache_large(third, "mask", object(), 7_500)
+    uploads.cache_large(third, "edges", object(), 7_500)
+    
+    assert list(uploads._derived) == [first.upload_id, third.upload_id]
+
+
+def test_small_values_count_and_oversized_values_are_not_cached():
+    upload = _stored(1)
+    upload.cache["faces"] = [(0, 0, 10, 10)]
+    assert uploads._cached_bytes(upload.upload_id) == uploads.UPLOAD_CACHE_SMALL_BYTES
+    
+    uploads.cache_large(upload, "image", object(), 5_000)
+    assert not uploads.cache_large(upload, "image", object(), 20_000)
+    assert "image" not in upload.cache
+    assert uploads._cached_bytes(upload.upload_id) == uploads.UPLOAD_CACHE_SMALL_BYTES
@@ -0,0 +1,53 @@
+"""
+Streaming ZIP writer tests
+"""
+import io
+import zipfile
+
+from zipstream import compression_for, iter_zip
+
+
+def _entries(produced):
+    for name, data in (("page-1.png", b"\x89PNG" + bytes(5000)), ("notes.txt", b"hello " * 1000)):
+        produced.append(name)
+        yield name, data
+
+
+def test_archive_round_trips():
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(_entries([])))))
+    assert archive.namelist() == ["page-1.png", "notes.txt"]
+    assert archive.read("notes.txt") == b"hello " * 1000
+    assert archive.testzip() is None
+
+
+def test_entries_are_streamed_as_they_are_produced():
+    produced = []
+    chunks = iter_zip(_entries(produced))
+    
+    first = next(chunks)
+    assert produced == ["page-1.png"]
+    assert first.startswith(b"PK\x03\x04")
+
+
+def test_compression_is_picked_per_entry():
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(_entries([])))))
+    assert archive.getinfo("page-1.png").compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo("notes.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_compression_overrides():
+    entries = [("a.txt", b"a" * 100), ("b.jpg", b"b" * 100, zipfile.ZIP_DEFLATED)]
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(iter_zip(entries, zipfile.ZIP_STORED))))
+    assert archive.getinfo("a.txt").compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo("b.jpg").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_compression_for_ignores_case():
+    assert compression_for("Scan.JPG") == zipfile.ZIP_STORED
+    assert compression_for("report.docx") == zipfile.ZIP_STORED
+    assert compression_for("data.csv") == zipfile.ZIP_DEFLATED
+    assert compression_for("README") == zipfile.ZIP_DEFLATED
+
+
+def test_empty_archive():
+    assert zipfile.ZipFile(io.BytesIO(b"".join(iter_zip([])))).namelist() == []
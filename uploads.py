@@ -0,0 +1,609 @@
+"""
+Upload ingestion - stream uploads in chunks with a size cap
+Small files stay in memory, larger ones spill to a temp file on disk
+"""
+from fastapi import HTTPException, UploadFile
+import asyncio
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, Tuple, Union
+
+
+# Read size per chunk while streaming an upload
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Uploads larger than this are spooled to disk instead of kept in memory
+SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", 2 * 1024 * 1024))  # 2MB
+
+# Where spooled uploads live (None = system temp dir)
+SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+
+class IngestedUpload:
+    """
+    An upload that has been size-checked and hashed while streaming.
+
+    Tools read it through stream(), view() or path() instead of holding a
+    bytes copy. Spooled temp files are removed on close() (or when the
+    object is garbage collected).
+
+    cache holds decoded or derived data (decoded image, detected faces...)
+    for reuse within the call - or across calls for stored uploads, which
+    also have an upload_id.
+    """
+
+    def __init__(self, filename: str, spool: BinaryIO, size: int, sha256: str):
+        self.filename = filename or "upload"
+        self.size = size
+        self.sha256 = sha256
+        self.upload_id = None
+        self.cache = {}
+        self._spool = spool
+        self._path_file = None
+        self._mmap = None
+
+    @property
+    def on_disk(self) -> bool:
+        """True if the upload was spooled to a temp file"""
+        return not isinstance(self._spool, io.BytesIO)
+
+    @property
+    def suffix(self) -> str:
+        """File extension of the original filename (e.g. '.pdf')"""
+        return Path(self.filename).suffix.lower()
+
+    def stream(self) -> BinaryIO:
+        """Get a seekable binary file object positioned at the start"""
+        self._spool.seek(0)
+        return self._spool
+
+    def head(self, n: int) -> bytes:
+        """Read the first n bytes (for magic-byte sniffing)"""
+        self._spool.seek(0)
+        data = self._spool.read(n)
+        self._spool.seek(0)
+        return data
+
+    def view(self) -> Union[memoryview, mmap.mmap]:
+        """
+        Get a zero-copy buffer over the upload.
+
+        Returns:
+            memoryview for in-memory uploads, read-only mmap for spooled ones
+        """
+        if not self.on_disk:
+            return self._spool.getbuffer()
+        if self.size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._spool.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def read_bytes(self) -> bytes:
+        """Copy the whole upload into a bytes object (avoid for large files)"""
+        return bytes(self.view())
+
+    def path(self) -> str:
+        """
+        Get a filesystem path for tools that only accept filenames.
+
+        In-memory uploads are written to a temp file on first call.
+        """
+        if self.on_disk:
+            return self._spool.name
+
+        if self._path_file is None:
+            self._path_file = tempfile.NamedTemporaryFile(suffix=self.suffix, dir=SPOOL_DIR)
+            self._path_file.write(self._spool.getbuffer())
+            self._path_file.flush()
+        return self._path_file.name
+
+    def save_as(self, destination: Union[str, Path]):
+        """Copy the upload to a file without loading it into memory"""
+        with open(destination, "wb") as f:
+            shutil.copyfileobj(self.stream(), f, CHUNK_SIZE)
+
+    def close(self):
+        """Release the buffer and delete any temp files"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._path_file is not None:
+            self._path_file.close()
+            self._path_file = None
+        try:
+            self._spool.close()
+        except BufferError:
+            # A view() is still referenced - the buffer is freed with it
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def ingest_upload(
+    file: UploadFile,
+    max_bytes: int,
+    error: str = "File too large",
+    spool_threshold: int = SPOOL_THRESHOLD
+) -> IngestedUpload:
+    """
+    Stream an upload in chunks, enforcing a size cap and hashing as it goes.
+
+    Reading stops as soon as the cap is exceeded, so an oversized upload is
+    never fully buffered. Data is kept in memory until it passes
+    spool_threshold, then moved to a temp file.
+
+    Args:
+        file: FastAPI UploadFile
+        max_bytes: Maximum accepted size in bytes
+        error: HTTP 400 detail when the cap is exceeded
+        spool_threshold: Size above which the upload is spooled to disk
+
+    Returns:
+        IngestedUpload
+
+    Raises:
+        HTTPException: 400 if the upload exceeds max_bytes
+    """
+    hasher = hashlib.sha256()
+    spool = io.BytesIO()
+    size = 0
+
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=400, detail=error)
+
+            hasher.update(chunk)
+
+            # Spill to disk once the threshold is passed
+            if isinstance(spool, io.BytesIO) and size > spool_threshold:
+                disk = tempfile.NamedTemporaryFile(suffix=Path(file.filename or "").suffix, dir=SPOOL_DIR)
+                disk.write(spool.getbuffer())
+                spool.close()
+                spool = disk
+
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.flush()
+    spool.seek(0)
+    return IngestedUpload(file.filename, spool, size, hasher.hexdigest())
+
+
+# ============================================================================
+# UPLOAD STORE
+# ============================================================================
+
+# Uploads kept for follow-up tool calls (one file + one .json sidecar each)
+UPLOAD_STORE_DIR = Path(os.getenv("UPLOAD_STORE_DIR", "uploads/store"))
+
+# Stored uploads expire after this many seconds
+UPLOAD_STORE_TTL = int(os.getenv("UPLOAD_STORE_TTL", 60 * 60))  # 1 hour
+
+# Stored uploads whose decoded/derived data is kept in memory (LRU)
+UPLOAD_CACHE_SIZE = int(os.getenv("UPLOAD_CACHE_SIZE", 16))
+
+# Decoded bytes all cached uploads may hold together (a 50 MP RGBA image
+# alone is ~200 MB); a single entry may use at most a quarter of it
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# What a cached value stored without a size (face boxes...) is counted as
+UPLOAD_CACHE_SMALL_BYTES = 4096
+
+_derived: "OrderedDict[str, dict]" = OrderedDict()
+_derived_sizes: Dict[str, Dict[str, int]] = {}
+
+
+def _meta_path(upload_id: str) -> Path:
+    """Sidecar path for an upload id (32 hex chars, so no path tricks)"""
+    if len(upload_id) != 32 or any(c not in "0123456789abcdef" for c in upload_id):
+        raise KeyError(upload_id)
+    return UPLOAD_STORE_DIR / f"{upload_id}.json"
+
+
+def derived_cache(upload_id: str) -> dict:
+    """
+    Per-upload dict for decoded images and other derived data.
+
+    Entries live in memory in this process only; the least recently used
+    uploads are dropped beyond UPLOAD_CACHE_SIZE.
+    """
+    cache = _derived.pop(upload_id, None)
+    if cache is None:
+        cache = {}
+    _derived[upload_id] = cache
+    _trim_derived()
+    return cache
+
+
+def _cached_bytes(upload_id: str) -> int:
+    """
+    Memory held by one upload's cache, from the keys it holds right now -
+    replaced or removed values are never counted twice
+    """
+    sizes = _derived_sizes.get(upload_id, {})
+    return sum(sizes.get(key, UPLOAD_CACHE_SMALL_BYTES) for key in _derived[upload_id])
+
+
+def _trim_derived():
+    """Drop least recently used entries beyond the count and byte limits"""
+    while _derived and (
+        len(_derived) > UPLOAD_CACHE_SIZE
+        or sum(_cached_bytes(upload_id) for upload_id in _derived) > UPLOAD_CACHE_MAX_BYTES
+    ):
+        upload_id, _ = _derived.popitem(last=False)
+        _derived_sizes.pop(upload_id, None)
+
+
+def cache_large(upload: "IngestedUpload", key: str, value, nbytes: int) -> bool:
+    """
+    Cache a large derived value (e.g. a decoded image) counted against
+    UPLOAD_CACHE_MAX_BYTES.
+
+    Values over a quarter of the budget aren't cached across calls, and
+    nothing is for uploads that weren't stored.
+
+    Returns:
+        True if the value was cached
+    """
+    if not upload.upload_id or nbytes > UPLOAD_CACHE_MAX_BYTES // 4:
+        # Don't leave an older value under this key behind either
+        upload.cache.pop(key, None)
+        return False
+
+    upload.cache[key] = value
+    if upload.upload_id in _derived:
+        # Replaces the size of any value previously under this key
+        _derived_sizes.setdefault(upload.upload_id, {})[key] = nbytes
+        _trim_derived()
+    return True
+
+
+def store_upload(upload: IngestedUpload, owner_id: int, metadata: dict = None) -> dict:
+    """
+    Keep an upload on disk so later tool calls can reference it by id.
+
+    Args:
+        upload: Ingested upload to store
+        owner_id: User who may use the stored upload
+        metadata: Extra JSON-serialisable details (format, dimensions, ...)
+
+    Returns:
+        The stored record (upload_id, filename, size, sha256, expires_at, ...)
+    """
+    upload_id = uuid.uuid4().hex
+    data_path = _data_path(upload_id, upload.filename)
+    upload.save_as(data_path)
+    return _write_record(upload_id, owner_id, data_path, upload.filename, upload.size, upload.sha256, metadata)
+
+
+def _data_path(upload_id: str, filename: str) -> Path:
+    """Where a stored upload's bytes live"""
+    UPLOAD_STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Keep the extension - some converters pick a parser by it
+    suffix = Path(filename or "").suffix.lower()
+    if not (suffix[1:].isalnum() and len(suffix) <= 8):
+        suffix = ""
+    return UPLOAD_STORE_DIR / f"{upload_id}{suffix}"
+
+
+def _write_record(
+    upload_id: str,
+    owner_id: int,
+    data_path: Path,
+    filename: str,
+    size: int,
+    sha256: str,
+    metadata: dict = None
+) -> dict:
+    """Write the sidecar that makes a stored upload visible"""
+    record = {
+        "upload_id": upload_id,
+        "owner_id": owner_id,
+        "stored_as": data_path.name,
+        "filename": filename,
+        "size": size,
+        "sha256": sha256,
+        "expires_at": int(time.time()) + UPLOAD_STORE_TTL,
+        **(metadata or {}),
+    }
+    with open(_meta_path(upload_id), "w") as f:
+        json.dump(record, f)
+
+    return record
+
+
+def get_stored_upload(upload_id: str, owner_id: int) -> dict:
+    """
+    Look up a stored upload's record.
+
+    Raises:
+        KeyError: If the id is unknown, expired or owned by someone else
+    """
+    try:
+        with open(_meta_path(upload_id)) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        raise KeyError(upload_id)
+
+    if record["owner_id"] != owner_id or not (UPLOAD_STORE_DIR / record["stored_as"]).exists():
+        raise KeyError(upload_id)
+
+    if record["expires_at"] < time.time():
+        delete_stored_upload(upload_id)
+        raise KeyError(upload_id)
+
+    return record
+
+
+def open_stored_upload(upload_id: str, owner_id: int) -> IngestedUpload:
+    """
+    Open a stored upload for a tool call.
+
+    The returned upload reads straight from the stored file (path() needs
+    no copy) and carries the upload's derived-data cache. Closing it
+    leaves the stored file in place.
+
+    Raises:
+        KeyError: If the id is unknown, expired or owned by someone else
+    """
+    record = get_stored_upload(upload_id, owner_id)
+    data_path = UPLOAD_STORE_DIR / record["stored_as"]
+    upload = IngestedUpload(record["filename"], open(data_path, "rb"), record["size"], record["sha256"])
+    upload.upload_id = upload_id
+    upload.cache = derived_cache(upload_id)
+    return upload
+
+
+def delete_stored_upload(upload_id: str):
+    """Remove a stored upload and its cached data"""
+    _meta_path(upload_id)  # rejects malformed ids before the glob
+    _derived.pop(upload_id, None)
+    _derived_sizes.pop(upload_id, None)
+    for path in UPLOAD_STORE_DIR.glob(f"{upload_id}*"):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def purge_expired_uploads():
+    """Delete every stored or partial upload past its expiry time"""
+    now = time.time()
+
+    for directory, delete in ((UPLOAD_STORE_DIR, delete_stored_upload), (RESUMABLE_DIR, delete_resumable)):
+        if not directory.exists():
+            continue
+
+        for meta_path in directory.glob("*.json"):
+            try:
+                with open(meta_path) as f:
+                    expired = json.load(f)["expires_at"] < now
+            except (OSError, ValueError, KeyError):
+                expired = True
+            if expired:
+                delete(meta_path.stem)
+
+
+# ============================================================================
+# RESUMABLE UPLOADS
+# ============================================================================
+
+# In-progress chunked uploads (a .part file + a .json state file each)
+RESUMABLE_DIR = UPLOAD_STORE_DIR / "partial"
+
+# Unfinished uploads are dropped after this many seconds
+RESUMABLE_TTL = int(os.getenv("RESUMABLE_UPLOAD_TTL", 24 * 60 * 60))  # 24 hours
+
+# Running sha256 per upload: upload_id -> (hasher, bytes hashed)
+_hashers = {}
+
+# One writer per upload at a time
+_locks = {}
+
+
+class OffsetMismatchError(ValueError):
+    """Raised when a chunk does not start at the upload's current offset"""
+
+
+def _resumable_paths(upload_id: str) -> Tuple[Path, Path]:
+    """.part and .json paths for an upload id (validated like stored ids)"""
+    _meta_path(upload_id)
+    return RESUMABLE_DIR / f"{upload_id}.part", RESUMABLE_DIR / f"{upload_id}.json"
+
+
+def _save_state(state: dict):
+    """Persist a resumable upload's state"""
+    _, state_path = _resumable_paths(state["upload_id"])
+    with open(state_path, "w") as f:
+        json.dump(state, f)
+
+
+def create_resumable(owner_id: int, filename: str, length: int) -> dict:
+    """
+    Start a resumable upload of a known total length.
+
+    Args:
+        owner_id: User who may append to and use the upload
+        filename: Original filename
+        length: Total size in bytes
+
+    Returns:
+        Upload state (upload_id, offset, length, expires_at, ...)
+    """
+    RESUMABLE_DIR.mkdir(parents=True, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    part_path, _ = _resumable_paths(upload_id)
+    part_path.touch()
+
+    state = {
+        "upload_id": upload_id,
+        "owner_id": owner_id,
+        "filename": filename or "upload",
+        "length": length,
+        "offset": 0,
+        "expires_at": int(time.time()) + RESUMABLE_TTL,
+    }
+    _save_state(state)
+    _hashers[upload_id] = (hashlib.sha256(), 0)
+    return state
+
+
+def get_resumable(upload_id: str, owner_id: int) -> dict:
+    """
+    Look up a resumable upload's state.
+
+    Raises:
+        KeyError: If the id is unknown, expired or owned by someone else
+    """
+    part_path, state_path = _resumable_paths(upload_id)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        raise KeyError(upload_id)
+
+    if state["owner_id"] != owner_id or not part_path.exists():
+        raise KeyError(upload_id)
+
+    if state["expires_at"] < time.time():
+        delete_resumable(upload_id)
+        raise KeyError(upload_id)
+
+    return state
+
+
+def _hasher_at(upload_id: str, part_path: Path, offset: int):
+    """Running hash covering the first `offset` bytes (rebuilt after a restart)"""
+    hasher, hashed = _hashers.get(upload_id, (None, -1))
+    if hashed != offset:
+        hasher = hashlib.sha256()
+        with open(part_path, "rb") as f:
+            remaining = offset
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+    return hasher
+
+
+async def append_resumable(upload_id: str, owner_id: int, offset: int, chunks) -> dict:
+    """
+    Write the next chunk of a resumable upload straight to disk.
+
+    The chunk must start exactly at the current offset (a client that lost
+    a response asks with HEAD and resends from there). Whatever arrived
+    before a dropped connection is kept.
+
+    Args:
+        upload_id: Resumable upload id
+        owner_id: Requesting user
+        offset: Offset the client says the chunk starts at
+        chunks: Async iterator of bytes (e.g. request.stream())
+
+    Returns:
+        Updated upload state
+
+    Raises:
+        KeyError: Unknown, expired or foreign upload
+        OffsetMismatchError: offset is not the current offset
+        ValueError: Data runs past the declared length
+    """
+    lock = _locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        state = get_resumable(upload_id, owner_id)
+        if offset != state["offset"]:
+            raise OffsetMismatchError(f"Upload is at offset {state['offset']}")
+
+        part_path, _ = _resumable_paths(upload_id)
+        hasher = _hasher_at(upload_id, part_path, offset)
+        position = offset
+
+        try:
+            with open(part_path, "r+b") as f:
+                f.seek(offset)
+                f.truncate()
+                async for chunk in chunks:
+                    if position + len(chunk) > state["length"]:
+                        raise ValueError("Chunk runs past the declared upload length")
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    position += len(chunk)
+        finally:
+            # Keep what was written, even if the connection dropped
+            state["offset"] = position
+            _hashers[upload_id] = (hasher, position)
+            _save_state(state)
+
+    return state
+
+
+def complete_resumable(upload_id: str, owner_id: int) -> IngestedUpload:
+    """
+    Open a fully received resumable upload for inspection before finalizing.
+
+    Raises:
+        KeyError: Unknown, expired or foreign upload
+        ValueError: Not all bytes have arrived yet
+    """
+    state = get_resumable(upload_id, owner_id)
+    if state["offset"] != state["length"]:
+        raise ValueError(f"Upload incomplete: {state['offset']} of {state['length']} bytes received")
+
+    part_path, _ = _resumable_paths(upload_id)
+    hasher = _hasher_at(upload_id, part_path, state["offset"])
+    return IngestedUpload(state["filename"], open(part_path, "rb"), state["length"], hasher.hexdigest())
+
+
+def finalize_resumable(upload: IngestedUpload, upload_id: str, owner_id: int, metadata: dict = None) -> dict:
+    """
+    Turn a completed resumable upload into a stored upload with the same id.
+
+    The .part file is moved into the store, not copied.
+
+    Returns:
+        The stored record, usable as upload_id in any tool call
+    """
+    part_path, _ = _resumable_paths(upload_id)
+    data_path = _data_path(upload_id, upload.filename)
+    upload.close()
+    os.replace(part_path, data_path)
+
+    record = _write_record(upload_id, owner_id, data_path, upload.filename, upload.size, upload.sha256, metadata)
+    delete_resumable(upload_id)
+    return record
+
+
+def delete_resumable(upload_id: str):
+    """Drop an unfinished upload"""
+    _hashers.pop(upload_id, None)
+    _locks.pop(upload_id, None)
+    for path in _resumable_paths(upload_id):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,87 @@
+"""
+Streaming ZIP writer - yield archive bytes while entries are still being produced
+Used for multi-file responses so nothing has to be assembled on disk first
+"""
+import io
+import os
+import zipfile
+from typing import Iterable, Iterator, Tuple, Union
+
+
+# Formats that are already compressed - deflating them only costs CPU
+STORED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".webp", ".avif", ".gif",
+    ".zip", ".docx", ".xlsx", ".gz",
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only, non-seekable buffer for zipfile to write into.
+
+    zipfile falls back to data descriptors when it cannot seek, so each
+    entry can be flushed to the client as soon as it is written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        """Return and clear everything written since the last drain"""
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compression_for(name: str) -> int:
+    """Pick STORED for already-compressed files, DEFLATED for everything else"""
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_zip(
+    entries: Iterable[Union[Tuple[str, bytes], Tuple[str, bytes, int]]],
+    compression: int = None
+) -> Iterator[bytes]:
+    """
+    Build a ZIP archive incrementally.
+
+    Entries are pulled lazily, so memory stays bounded by one entry plus
+    whatever the producer keeps in flight. Each entry is yielded as soon
+    as it is written, so the first bytes go out with the first entry.
+
+    Args:
+        entries: Iterable of (archive_name, data) tuples, or
+            (archive_name, data, compression) to override it per entry
+        compression: zipfile.ZIP_DEFLATED or zipfile.ZIP_STORED for every
+            entry, None = pick by extension with compression_for()
+
+    Yields:
+        Chunks of the ZIP file, suitable for a StreamingResponse
+    """
+    sink = _ChunkSink()
+
+    with zipfile.ZipFile(sink, "w") as archive:
+        for entry in entries:
+            name, data = entry[0], entry[1]
+            if len(entry) > 2:
+                compress_type = entry[2]
+            else:
+                compress_type = compression if compression is not None else compression_for(name)
+            archive.writestr(name, data, compress_type=compress_type)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+
+    # Central directory
+    chunk = sink.drain()
+    if chunk:
+        yield chunk